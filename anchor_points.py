@@ -0,0 +1,70 @@
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def anchor_points(geometry, method='first_vertex'):
+    '''Returns a lon/lat frame with one anchor point per tract, computed on the whole
+    geometry array at once.
+
+    first_vertex takes the first vertex of the exterior ring of the tract's first
+    polygon, which is what the maps have always used, and also works for MultiPolygon
+    tracts. representative takes a point guaranteed to lie inside the tract.'''
+    values = geometry.values if hasattr(geometry, 'values') else np.asarray(geometry)
+    if method == 'first_vertex':
+        #first part of a MultiPolygon; a Polygon is returned unchanged
+        polygons = shapely.get_geometry(values, 0)
+        points = shapely.get_point(shapely.get_exterior_ring(polygons), 0)
+    elif method == 'representative':
+        points = shapely.point_on_surface(values)
+    else:
+        raise ValueError("method must be 'first_vertex' or 'representative', not %r" % method)
+    return pd.DataFrame({'lon': shapely.get_x(points), 'lat': shapely.get_y(points)})
+
+
+def geojson_anchor_points(frame):
+    '''The previous approach: serialize to GeoJSON, parse it back and loop over features.
+    Kept for benchmarking; a MultiPolygon tract adds a whole ring of points instead of one'''
+    json_features = json.loads(frame.to_json())
+    points = []
+    for tract in json_features['features']:
+        first_point = tract['geometry']['coordinates'][0][0]
+        points.append(first_point)
+    return pd.DataFrame(np.vstack(points))
+
+
+def benchmark(frame, repeat=3):
+    '''Times the GeoJSON round trip against the vectorized anchor points'''
+    results = {'tracts': len(frame)}
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        geojson_points = geojson_anchor_points(frame)
+    results['geojson'] = (time.perf_counter() - start) / repeat
+    results['geojson_extra_rows'] = len(geojson_points) - len(frame)
+
+    for method in ['first_vertex', 'representative']:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            anchor_points(frame.geometry, method)
+        results[method] = (time.perf_counter() - start) / repeat
+    return results
+
+
+if __name__ == '__main__':
+    #usage: python anchor_points.py [STATEFP] -- benchmarks one state (default Michigan) and every stored state
+    from tract_store import available_states, load_state_tracts
+
+    statefp = int(sys.argv[1]) if len(sys.argv) > 1 else 26
+    scales = [('state %02d' % statefp, [statefp])]
+    if len(available_states()) > 1:
+        scales.append(('national', available_states()))
+    for name, statefps in scales:
+        results = benchmark(load_state_tracts(statefps))
+        print('%s (%d tracts): geojson loop %.1f ms (%d wrong extra rows), first_vertex %.1f ms, representative %.1f ms' % (
+            name, results['tracts'], results['geojson'] * 1000, results['geojson_extra_rows'],
+            results['first_vertex'] * 1000, results['representative'] * 1000))
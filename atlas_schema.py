@@ -0,0 +1,65 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from lila_rules import LILA_FLAGS, RULE_COLUMNS
+
+#columns of ERSAtlas_CensusData.csv used by the state level aggregations
+CENSUS_DATA_COLUMNS = ['State', 'region', 'County', 'food_desert_label', 'MedianIncome', 'Walk', 'TotalPop', 'ChildPoverty',
+                       'Service', 'Construction', 'Hispanic', 'Asian', 'White', 'Black', 'Native', 'Pacific']
+
+#columns of the food atlas used by the maps and the LILA rule engine
+FOOD_ATLAS_COLUMNS = ['CensusTract', 'State', 'County', 'TractSNAP', 'TractSeniors', 'PovertyRate'] + LILA_FLAGS + RULE_COLUMNS
+
+#low cardinality text columns stored as categoricals
+CATEGORICAL_COLUMNS = ['State', 'region', 'County']
+
+#join keys keep their int64 dtype so merges against GEOID stay exact
+KEY_COLUMNS = ['CensusTract']
+
+
+def downcast_lossless(frame, keep=KEY_COLUMNS):
+    '''Downcasts numeric columns in place wherever every value survives the round trip:
+    integers (and whole valued floats without NaN) to the smallest integer type,
+    other floats to float32 when no value changes'''
+    for column in frame.columns:
+        if column in keep:
+            continue
+        values = frame[column]
+        if pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values):
+            continue
+        if pd.api.types.is_float_dtype(values) and not values.isna().any() and np.array_equal(values, np.round(values)):
+            values = values.astype(np.int64)
+        if pd.api.types.is_integer_dtype(values):
+            frame[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            as_float32 = values.astype(np.float32)
+            if np.array_equal(as_float32.astype(np.float64), values, equal_nan=True):
+                frame[column] = as_float32
+    return frame
+
+
+def read_atlas(path, columns, categoricals=CATEGORICAL_COLUMNS):
+    '''Reads only the given columns of an atlas CSV (missing ones are skipped), with
+    text columns as categoricals and numerics downcast without losing precision'''
+    wanted = set(columns)
+    frame = pd.read_csv(path, usecols=lambda c: c in wanted,
+                        dtype={c: 'category' for c in categoricals if c in wanted})
+    return downcast_lossless(frame)
+
+
+def memory_report(path, columns):
+    '''Returns the memory used by a default full read and by read_atlas, in bytes'''
+    before = pd.read_csv(path).memory_usage(deep=True).sum()
+    after = read_atlas(path, columns).memory_usage(deep=True).sum()
+    return int(before), int(after)
+
+
+if __name__ == '__main__':
+    #usage: python atlas_schema.py [ERSAtlas_CensusData.csv] [MI_food_atlas2019.csv]
+    census_path = sys.argv[1] if len(sys.argv) > 1 else 'ERSAtlas_CensusData.csv'
+    atlas_path = sys.argv[2] if len(sys.argv) > 2 else 'MI_food_atlas2019.csv'
+    for path, columns in [(census_path, CENSUS_DATA_COLUMNS), (atlas_path, FOOD_ATLAS_COLUMNS)]:
+        before, after = memory_report(path, columns)
+        print('%s: %.1f MB before, %.1f MB after (%.0f%% saved)' % (path, before / 1e6, after / 1e6, 100 * (1 - after / before)))
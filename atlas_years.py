@@ -0,0 +1,103 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from lila_rules import LILA_FLAGS, food_desert_labels
+
+ROOT_DIR = os.path.dirname(__file__)
+
+#releases of the food access research atlas, each saved as <state>_food_atlas<year>.csv.
+#all three use 2010 census tracts, so they share one set of tract geometries
+ATLAS_YEARS = [2010, 2015, 2019]
+
+#status of a tract between two years, by its label in the first and in the second year
+STATUS_CHANGES = {(0, 0): 'Never a food desert', (1, 1): 'Stayed a food desert',
+                  (0, 1): 'Became a food desert', (1, 0): 'No longer a food desert'}
+MISSING_STATUS = 'Not in both atlases'
+
+
+def atlas_path(year, state='MI', root=ROOT_DIR):
+    return os.path.join(root, '%s_food_atlas%d.csv' % (state, year))
+
+
+def available_years(state='MI', root=ROOT_DIR):
+    '''Lists the atlas years whose CSV is present'''
+    return [year for year in ATLAS_YEARS if os.path.exists(atlas_path(year, state, root))]
+
+
+def read_year(path):
+    '''Reads one atlas year and labels its tracts with the flags that year has'''
+    atlas = read_atlas(path, FOOD_ATLAS_COLUMNS)
+    atlas['food_desert_label'] = food_desert_labels(atlas, [flag for flag in LILA_FLAGS if flag in atlas])
+    return atlas
+
+
+def _whole(values):
+    '''Whether an atlas column holds only whole numbers, a count read as float when it has gaps'''
+    if pd.api.types.is_integer_dtype(values):
+        return True
+    if not pd.api.types.is_float_dtype(values):
+        return False
+    values = values.dropna().to_numpy(dtype=np.float64)
+    return np.array_equal(values, np.round(values))
+
+
+class YearTable(object):
+    '''Attribute columns of several atlas years for one set of tracts. Each column is a
+    single (tracts x years) float64 array aligned to the sorted tract keys, NaN where a
+    tract is missing, so the geometry is kept once and every year only adds a column of numbers'''
+
+    def __init__(self, keys, atlases, columns, key='CensusTract'):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        if len(self.keys) and (np.diff(self.keys) <= 0).any():
+            raise ValueError('keys must be sorted and unique')
+        self.years = sorted(atlases)
+        #float64 holds every count exactly and prints a rate as the atlas wrote it (float32 turned 12.3 into 12.3000001907)
+        self.columns = {column: np.full((len(self.keys), len(self.years)), np.nan) for column in columns}
+        #columns that are whole numbers in every atlas they appear in, given back as nullable integers
+        self.counts = {column for column in columns if all(_whole(atlas[column]) for atlas in atlases.values() if column in atlas)}
+        for j, year in enumerate(self.years):
+            atlas = atlases[year]
+            atlas_keys = atlas[key].to_numpy(dtype=np.int64)
+            rows = np.minimum(np.searchsorted(self.keys, atlas_keys), max(len(self.keys) - 1, 0))
+            found = self.keys[rows] == atlas_keys
+            for column, values in self.columns.items():
+                if column in atlas:
+                    values[rows[found], j] = atlas[column].to_numpy(dtype=np.float64)[found]
+
+    def year(self, year):
+        '''Returns the columns of one year as a frame in key order; the label and the counts are
+        nullable integers, missing (like the rates) where the tract is not in that year's atlas'''
+        j = self.years.index(year)
+        frame = pd.DataFrame({column: values[:, j] for column, values in self.columns.items()})
+        for column in self.counts:
+            frame[column] = frame[column].astype('Int8' if column == 'food_desert_label' else 'Int64')
+        return frame
+
+    def status_change(self, first, last):
+        '''Returns, per tract, how its food desert status changed from one year to another'''
+        labels = self.columns['food_desert_label']
+        before, after = labels[:, self.years.index(first)], labels[:, self.years.index(last)]
+        status = np.full(len(self.keys), MISSING_STATUS, dtype=object)
+        for (was, now), name in STATUS_CHANGES.items():
+            status[(before == was) & (after == now)] = name
+        return status
+
+    def nbytes(self):
+        return self.keys.nbytes + sum(values.nbytes for values in self.columns.values())
+
+
+if __name__ == '__main__':
+    #usage: python atlas_years.py [state] -- summarises the change between the first and last atlas year
+    state = sys.argv[1] if len(sys.argv) > 1 else 'MI'
+    years = available_years(state)
+    if len(years) < 2:
+        sys.exit('need at least two of %s' % ', '.join(os.path.basename(atlas_path(y, state)) for y in ATLAS_YEARS))
+    atlases = {year: read_year(atlas_path(year, state)) for year in years}
+    keys = np.unique(np.concatenate([atlas['CensusTract'].to_numpy(dtype=np.int64) for atlas in atlases.values()]))
+    table = YearTable(keys, atlases, ['food_desert_label', 'TractSNAP', 'TractSeniors', 'PovertyRate'])
+    print('%d tracts, %d years, %.2f MB' % (len(keys), len(years), table.nbytes() / 1e6))
+    print(pd.Series(table.status_change(years[0], years[-1])).value_counts().to_string())
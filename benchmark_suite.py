@@ -0,0 +1,187 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import altair as alt
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from anchor_points import anchor_points
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from geo_datasets import chart_spec, register_geography
+from lila_rules import ACCESS_DISTANCES, LILA_FLAGS, food_desert_labels
+from tract_store import ingest, load_state_tracts
+from tract_keys import KeyIndex, merge_join, parse_geoids
+
+ROOT_DIR = os.path.dirname(__file__)
+BENCH_DATA_DIR = os.path.join(ROOT_DIR, ".cache", "bench_data")
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmark_results")
+
+#number of states and of tracts in each synthetic dataset; Michigan (always the first state,
+#and the one mapped) has about 2,800 tracts and the country about 73,000
+MI_TRACTS = 2800
+SCALES = {'michigan': (1, MI_TRACTS), 'ten_states': (10, 28000), 'national': (51, 73000)}
+STATEFPS = [26, 1, 4, 5, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 27, 28, 29, 30, 31, 32, 33,
+            34, 35, 36, 37, 38, 39, 40, 41, 42, 44, 45, 46, 47, 48, 49, 50, 51, 53, 54, 55, 56, 2]
+
+#vertices per synthetic tract ring, about what a 500k cartographic boundary tract has
+QUAD_SEGS = 12
+MAP_COLUMNS = ['food_desert_label', 'TractSNAP', 'TractSeniors', 'PovertyRate']
+STAGES = ['csv_load', 'shapefile_load', 'store_load', 'statefp_filter', 'key_index', 'key_slice', 'labels', 'merge', 'merge_join', 'to_json', 'anchors', 'spec']
+
+
+def scale_dir(scale):
+    return os.path.join(BENCH_DATA_DIR, scale)
+
+
+def synthetic_tracts(states, total, seed=0):
+    '''Returns a tract frame laid out like the census shapefile: per state a grid of
+    roughly round tracts, with STATEFP and GEOID as text'''
+    rng = np.random.default_rng(seed)
+    counts = [MI_TRACTS] + [(total - MI_TRACTS) // max(states - 1, 1)] * (states - 1)
+    frames = []
+    for n, (statefp, per_state) in enumerate(zip(STATEFPS, counts)):
+        side = int(np.ceil(np.sqrt(per_state)))
+        i = np.arange(per_state)
+        x = -124 + (n % 10) * 5.5 + (i % side) * 5.0 / side
+        y = 26 + (n // 10) * 4.5 + (i // side) * 4.0 / side
+        radius = rng.uniform(0.3, 0.5, per_state) * 4.0 / side
+        geometry = shapely.buffer(shapely.points(x, y), radius, quad_segs=QUAD_SEGS)
+        counties = 1 + 2 * (i * 80 // per_state)
+        geoids = statefp * 10 ** 9 + counties * 10 ** 6 + 100 + i
+        frames.append(gpd.GeoDataFrame({'STATEFP': '%02d' % statefp, 'GEOID': ['%011d' % g for g in geoids]}, geometry=geometry, crs=4269))
+    return pd.concat(frames, ignore_index=True)
+
+
+def synthetic_atlas(tracts, seed=0):
+    '''Returns a food atlas with every column the app reads, for the given tracts'''
+    rng = np.random.default_rng(seed)
+    n = len(tracts)
+    geoids = tracts['GEOID'].astype('int64').to_numpy()
+    atlas = pd.DataFrame({'CensusTract': geoids, 'State': ['State %02d' % s for s in geoids // 10 ** 9], 'County': ['County %03d' % c for c in geoids // 10 ** 6 % 1000],
+                          'Urban': rng.integers(0, 2, n), 'Pop2010': rng.integers(500, 8000, n), 'PovertyRate': rng.uniform(0, 60, n).round(1),
+                          'MedianFamilyIncome': rng.integers(20000, 200000, n), 'TractSNAP': rng.integers(0, 900, n),
+                          'TractSeniors': rng.integers(0, 1500, n), 'LATractsVehicle_20': rng.integers(0, 2, n)})
+    for flag in LILA_FLAGS:
+        atlas[flag] = (rng.random(n) < 0.1).astype(int)
+    for column in ACCESS_DISTANCES.values():
+        atlas[column] = (rng.random(n) * atlas['Pop2010']).round(2)
+    return atlas[list(dict.fromkeys(FOOD_ATLAS_COLUMNS))]
+
+
+def generate(scale):
+    '''Writes the synthetic atlas CSV, tract shapefile and tract store of a scale, once'''
+    directory = scale_dir(scale)
+    if os.path.exists(os.path.join(directory, "done")):
+        return directory
+    os.makedirs(directory, exist_ok=True)
+    tracts = synthetic_tracts(*SCALES[scale])
+    synthetic_atlas(tracts).to_csv(os.path.join(directory, "food_atlas.csv"), index=False)
+    tracts.to_file(os.path.join(directory, "tracts.shp"))
+    ingest(os.path.join(directory, "tracts.shp"), os.path.join(directory, "tract_store"))
+    open(os.path.join(directory, "done"), "w").close()
+    return directory
+
+
+def _timed(results, stage, function, repeat):
+    '''Runs function repeat times, stores the best time under stage and returns its result'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    results[stage] = min(times)
+    return result
+
+
+def run_scale(scale, repeat=3):
+    '''Times each stage of the group_project.py pipeline on one synthetic scale, with
+    Michigan (STATEFP 26) as the state that is mapped'''
+    directory = generate(scale)
+    stages = {}
+    atlas = _timed(stages, 'csv_load', lambda: read_atlas(os.path.join(directory, "food_atlas.csv"), FOOD_ATLAS_COLUMNS), repeat)
+    tracts = _timed(stages, 'shapefile_load', lambda: gpd.read_file(os.path.join(directory, "tracts.shp")), repeat)
+    _timed(stages, 'store_load', lambda: load_state_tracts([26], os.path.join(directory, "tract_store")), repeat)
+    michigan = _timed(stages, 'statefp_filter', lambda: tracts[tracts['STATEFP'] == '26'], repeat)
+    michigan = michigan.assign(GEOID=michigan['GEOID'].astype('int64'))
+    #the same state as a range of the sorted int64 GEOIDs, with the index built once
+    keys = _timed(stages, 'key_index', lambda: KeyIndex(parse_geoids(tracts['GEOID'])), repeat)
+    _timed(stages, 'key_slice', lambda: keys.take(tracts, 26), repeat)
+    labels = _timed(stages, 'labels', lambda: food_desert_labels(atlas), repeat)
+    atlas = atlas.assign(food_desert_label=labels)
+    merged = _timed(stages, 'merge', lambda: michigan.merge(atlas, left_on='GEOID', right_on='CensusTract', how='inner')[
+        ['geometry', 'CensusTract'] + MAP_COLUMNS], repeat)
+    michigan_keys, atlas_keys = KeyIndex(michigan['GEOID']), KeyIndex(atlas['CensusTract'])
+    _timed(stages, 'merge_join', lambda: merge_join(michigan[['GEOID', 'geometry']], atlas[['CensusTract'] + MAP_COLUMNS], 'GEOID', 'CensusTract',
+                                                    michigan_keys, atlas_keys), repeat)
+    _timed(stages, 'to_json', lambda: json.loads(merged.to_json()), repeat)
+    _timed(stages, 'anchors', lambda: anchor_points(merged.geometry), repeat)
+
+    def spec():
+        geo = register_geography('bench', merged, MAP_COLUMNS)
+        chart = geo.chart(['food_desert_label']).mark_geoshape().encode(color=alt.Color('food_desert_label:N'))
+        return len(json.dumps(chart_spec(chart), separators=(',', ':')))
+    spec_size = _timed(stages, 'spec', spec, repeat)
+    return {'tracts': len(tracts), 'mapped_tracts': len(merged), 'spec_bytes': spec_size, 'seconds': stages}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales=SCALES, repeat=3):
+    '''Runs every scale and writes the results to benchmark_results/<commit>.json'''
+    results = {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'pandas': pd.__version__, 'geopandas': gpd.__version__, 'repeat': repeat, 'scales': {}}
+    for scale in scales:
+        results['scales'][scale] = run_scale(scale, repeat)
+        print_scale(scale, results['scales'][scale])
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "%s.json" % (results['commit'] or time.strftime('%Y%m%d-%H%M%S')))
+    with open(path, "w") as f:
+        json.dump(results, f, indent=1)
+    print("results written to %s" % path)
+    return path
+
+
+def print_scale(scale, result):
+    print("%s (%d tracts, %d mapped, %.0f KB spec)" % (scale, result['tracts'], result['mapped_tracts'], result['spec_bytes'] / 1024))
+    for stage in STAGES:
+        print("  %-15s %9.1f ms" % (stage, result['seconds'][stage] * 1000))
+
+
+def compare(old_path, new_path, threshold=0.1):
+    '''Prints each stage's change between two result files, flagging slowdowns over threshold'''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("%s -> %s" % (old['commit'], new['commit']))
+    for scale in new['scales']:
+        if scale not in old['scales']:
+            continue
+        print(scale)
+        for stage in STAGES:
+            before, after = old['scales'][scale]['seconds'].get(stage), new['scales'][scale]['seconds'].get(stage)
+            if before is None or after is None:
+                continue
+            change = after / before - 1 if before else 0
+            flag = "  REGRESSION" if change > threshold else ""
+            print("  %-15s %9.1f ms -> %9.1f ms (%+.0f%%)%s" % (stage, before * 1000, after * 1000, change * 100, flag))
+
+
+if __name__ == "__main__":
+    #usage: python benchmark_suite.py [scale ...]          -- michigan, ten_states, national (default all)
+    #       python benchmark_suite.py compare old.json new.json
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        run(sys.argv[1:] or list(SCALES))
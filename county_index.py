@@ -0,0 +1,39 @@
+import numpy as np
+
+from tract_keys import COUNTY_DIGITS
+
+
+class CountyIndex(object):
+    '''Maps each county GEOID to the row range its tracts occupy in a frame sorted
+    by CensusTract, so picking a county is a slice rather than a scan of every tract'''
+
+    def __init__(self, frame, key='CensusTract', name_column='County'):
+        keys = frame[key].to_numpy(dtype=np.int64)
+        if len(keys) and (np.diff(keys) < 0).any():
+            raise ValueError('frame must be sorted by %s to build a county index' % key)
+        codes, starts = np.unique(keys // COUNTY_DIGITS, return_index=True)
+        stops = np.append(starts[1:], len(keys))
+        self.ranges = {int(code): (int(start), int(stop)) for code, start, stop in zip(codes, starts, stops)}
+
+        #display name of each county, with the state code added when several states are loaded
+        names = frame[name_column].to_numpy()[starts] if name_column in frame else codes.astype(str)
+        several_states = len(set(codes // 1000)) > 1
+        self.names = {}
+        for code, name in zip(codes, names):
+            self.names[int(code)] = '%s (%02d)' % (name, code // 1000) if several_states else str(name)
+        self.codes = {name: code for code, name in self.names.items()}
+
+    def counties(self):
+        '''Returns the county names in alphabetical order, for a sidebar picker'''
+        return sorted(self.codes)
+
+    def code(self, name):
+        '''Returns the county GEOID of a county name'''
+        return self.codes[name]
+
+    def rows(self, frame, county):
+        '''Returns the rows of frame belonging to county (a GEOID or a name)'''
+        if not isinstance(county, (int, np.integer)):
+            county = self.code(county)
+        start, stop = self.ranges[county]
+        return frame.iloc[start:stop]
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from perf_spans import span
+
+#shallow copies of the cached frames only keep sessions from writing into them under
+#copy-on-write, the default from pandas 3; older pandas has to be asked for it
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+ROOT_DIR = os.path.dirname(__file__)
+CACHE_DIR = os.path.join(ROOT_DIR, ".cache")
+
+#in-process copies so a streamlit rerun does not even touch the disk. They are shared by every
+#session of the server process and handed out read only (see _share)
+_memory_cache = {}
+
+#hit/miss counters and rebuild times, per cached name
+cache_stats = {}
+#misses already covered by a cache_report(changes_only=True)
+_reported_misses = 0
+_reported_lock = threading.Lock()
+
+#one lock per cached name, so when several sessions ask for a frame that is not cached yet
+#the first one builds it and the others wait for its result instead of building it again
+_name_locks = {}
+_name_locks_lock = threading.Lock()
+
+
+def input_signature(paths):
+    '''Returns a list of (path, size, mtime) tuples describing the input files.
+    A missing file is recorded with size and mtime of None.'''
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((os.path.abspath(path), None, None))
+    return signature
+
+
+def cache_key(name, paths, version=""):
+    '''Builds the cache key for a frame from its name, the signature of its
+    input files and an optional version string.'''
+    raw = repr((name, input_signature(paths), version)).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _record(name, event, seconds=0.0):
+    stats = cache_stats.setdefault(name, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "rebuild_seconds": 0.0})
+    stats[event] += 1
+    stats["rebuild_seconds"] += seconds
+
+
+def _freeze(value):
+    '''Makes the arrays held by a cached object (YearTable, TractIndex, ...) read only in
+    place, so a session writing into one gets an error instead of changing it for all'''
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for v in value.values():
+            _freeze(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _freeze(v)
+    elif hasattr(value, "__dict__") and not isinstance(value, (pd.DataFrame, pd.Series, type)) and not sparse.issparse(value):
+        _freeze(vars(value))
+
+
+def _share(value):
+    '''Hands out a cached value without copying its data. Frames and series come back as
+    shallow copies, which pandas copy-on-write turns into a private copy only when the
+    caller writes to one; arrays come back as read only views and dicts as read only
+    mappings. Other objects are the one shared instance, their arrays frozen by _freeze:
+    callers must not rebind their attributes. Sparse matrices are shared as they are and
+    must not be changed either'''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, np.ndarray):
+        view = value.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(value, tuple):
+        return tuple(_share(v) for v in value)
+    if isinstance(value, dict):
+        return MappingProxyType({k: _share(v) for k, v in value.items()})
+    return value
+
+
+def _name_lock(name):
+    with _name_locks_lock:
+        #reentrant, in case a builder asks for its own name again
+        return _name_locks.setdefault(name, threading.RLock())
+
+
+def cached_frame(name, paths, builder, version="", keep=True):
+    '''Returns the frame produced by builder(), memoized in memory and on disk.
+    The cached copy is reused while every file in paths keeps the same size
+    and mtime, and rebuilt as soon as any of them changes. keep=False is for
+    intermediates: they are cached on disk only, not held in memory.'''
+    key = cache_key(name, paths, version)
+
+    cached_key, frame = _memory_cache.get(name, (None, None))
+    if cached_key == key:
+        _record(name, "memory_hits")
+        return _share(frame)
+
+    with _name_lock(name):
+        #another session may have built it while this one waited for the lock
+        cached_key, frame = _memory_cache.get(name, (None, None))
+        if cached_key == key:
+            _record(name, "memory_hits")
+            return _share(frame)
+
+        cache_path = os.path.join(CACHE_DIR, name + "-" + key + ".pkl")
+        if os.path.exists(cache_path):
+            start = time.perf_counter()
+            with span(name, "load"), open(cache_path, "rb") as f:
+                frame = pickle.load(f)
+            _record(name, "disk_hits")
+            print("cache hit: %s (%.3fs from disk)" % (name, time.perf_counter() - start))
+        else:
+            start = time.perf_counter()
+            with span(name, "load"):
+                frame = builder()
+            elapsed = time.perf_counter() - start
+            _record(name, "misses", elapsed)
+            print("cache miss: %s (rebuilt in %.3fs)" % (name, elapsed))
+            _write(name, cache_path, frame)
+
+        _freeze(frame)
+        if keep:
+            _memory_cache[name] = (key, frame)
+    return _share(frame)
+
+
+def release(*names):
+    '''Drops intermediates from memory once what they were built into is cached; their
+    disk copies stay, so asking for one again is a disk hit'''
+    for name in names:
+        _memory_cache.pop(name, None)
+
+
+def shared_frames():
+    '''Returns name -> value of everything held in memory, shared by all sessions'''
+    return {name: value for name, (_, value) in _memory_cache.items()}
+
+
+def _write(name, cache_path, frame):
+    '''Writes a frame to the disk cache and removes stale copies of it. Called with the
+    name's lock held, so no other session is writing or reading copies of this name'''
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    #write to a temporary file of its own first so a crash never leaves a half written pickle
+    fd, tmp_path = tempfile.mkstemp(prefix=name + "-", suffix=".tmp", dir=CACHE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    #only <name>-<40 hex digit key>.pkl, so a name that merely starts with this one keeps its copies
+    for old in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, old)
+        if old.startswith(name + "-") and old.endswith(".pkl") and len(old) == len(name) + 45 and path != cache_path:
+            os.remove(path)
+
+
+def clear_cache():
+    '''Removes every cached frame from memory and disk.'''
+    _memory_cache.clear()
+    if os.path.isdir(CACHE_DIR):
+        for old in os.listdir(CACHE_DIR):
+            os.remove(os.path.join(CACHE_DIR, old))
+
+
+def cache_report(changes_only=False):
+    '''Returns a one line summary per cached name of hits, misses and rebuild time. With
+    changes_only, returns an empty string unless something was rebuilt since the last such call'''
+    global _reported_misses
+    if changes_only:
+        with _reported_lock:
+            misses = sum(stats["misses"] for stats in cache_stats.values())
+            if misses == _reported_misses:
+                return ""
+            _reported_misses = misses
+    lines = []
+    for name, stats in sorted(cache_stats.items()):
+        lines.append("%s: %d memory hits, %d disk hits, %d misses, %.3fs rebuilding" % (
+            name, stats["memory_hits"], stats["disk_hits"], stats["misses"], stats["rebuild_seconds"]))
+    return "\n".join(lines)
@@ -0,0 +1,142 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from atlas_schema import CENSUS_DATA_COLUMNS, read_atlas
+from atlas_years import atlas_path
+from data_cache import CACHE_DIR, cache_key
+from lila_rules import LILA_FLAGS, food_desert_labels
+
+ROOT_DIR = os.path.dirname(__file__)
+CENSUS_DATA_PATH = os.path.join(ROOT_DIR, "ERSAtlas_CensusData.csv")
+
+#scores the pages show, one json file per dataset
+IMPORTANCE_DIR = os.path.join(ROOT_DIR, "feature_importance")
+MATRIX_DIR = os.path.join(CACHE_DIR, "features")
+
+#numeric census columns the national model ranks; the label column is the target
+CENSUS_FEATURES = ['MedianIncome', 'Walk', 'TotalPop', 'ChildPoverty', 'Service', 'Construction',
+                   'Hispanic', 'Asian', 'White', 'Black', 'Native', 'Pacific']
+
+#food atlas columns the tract model ranks; the low access counts are left out since the label is built from them
+ATLAS_FEATURES = ['TractSeniors', 'TractSNAP', 'PovertyRate', 'MedianFamilyIncome', 'Pop2010', 'OHU2010', 'TractHUNV', 'Urban']
+
+FOLDS = 5
+REPEATS = 5
+TREES = 200
+SEED = 0
+
+
+def read_census(path):
+    '''Census features and food desert labels of ERSAtlas_CensusData.csv'''
+    frame = read_atlas(path, [c for c in CENSUS_DATA_COLUMNS if c in CENSUS_FEATURES or c == 'food_desert_label'])
+    return frame[[c for c in CENSUS_FEATURES if c in frame]], frame['food_desert_label'].to_numpy()
+
+
+def read_food_atlas(path):
+    '''Food atlas features and the label from the four LILA flags'''
+    frame = read_atlas(path, ATLAS_FEATURES + LILA_FLAGS)
+    return frame[[c for c in ATLAS_FEATURES if c in frame]], food_desert_labels(frame, [f for f in LILA_FLAGS if f in frame])
+
+
+def dataset_source(name):
+    '''Returns (csv path, reader) of a dataset name: census, or atlas<year> for a food atlas year'''
+    if name == 'census':
+        return CENSUS_DATA_PATH, read_census
+    if name.startswith('atlas'):
+        return atlas_path(int(name[len('atlas'):]), 'MI', ROOT_DIR), read_food_atlas
+    raise ValueError('unknown dataset %s, use census or atlas<year>' % name)
+
+
+def importance_path(name):
+    return os.path.join(IMPORTANCE_DIR, name + ".json")
+
+
+def feature_matrix(name):
+    '''Writes the float32 feature matrix and labels of a dataset as .npy files once per
+    version of its csv, and returns their folder; workers open them memory-mapped'''
+    path, reader = dataset_source(name)
+    folder = os.path.join(MATRIX_DIR, name + "-" + cache_key(name, [path]))
+    if not os.path.exists(os.path.join(folder, "features.json")):
+        features, labels = reader(path)
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, "X.npy"), features.to_numpy(dtype=np.float32, na_value=np.nan))
+        np.save(os.path.join(folder, "y.npy"), np.asarray(labels, dtype=np.int8))
+        #written last, so a folder without it is an interrupted write
+        with open(os.path.join(folder, "features.json"), "w") as f:
+            json.dump(list(features.columns), f)
+    return folder
+
+
+def open_matrix(folder):
+    '''Returns (X, y, feature names) of a feature matrix folder, X and y memory-mapped'''
+    with open(os.path.join(folder, "features.json")) as f:
+        features = json.load(f)
+    return np.load(os.path.join(folder, "X.npy"), mmap_mode="r"), np.load(os.path.join(folder, "y.npy"), mmap_mode="r"), features
+
+
+def _score_fold(folder, train, test, tree_jobs):
+    '''Fits one cross-validation fold and returns its test AUC and permutation importances'''
+    #scikit-learn takes seconds to import, the app only reads the written scores
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.inspection import permutation_importance
+    from sklearn.metrics import roc_auc_score
+    X, y, _ = open_matrix(folder)
+    model = RandomForestClassifier(n_estimators=TREES, min_samples_leaf=5, n_jobs=tree_jobs, random_state=SEED)
+    model.fit(X[train], y[train])
+    X_test, y_test = np.asarray(X[test]), np.asarray(y[test])
+    auc = roc_auc_score(y_test, model.predict_proba(X_test)[:, 1])
+    permuted = permutation_importance(model, X_test, y_test, scoring="roc_auc", n_repeats=REPEATS, random_state=SEED, n_jobs=1)
+    return auc, permuted.importances
+
+
+def train(name, workers=None):
+    '''Cross-validates a random forest on a dataset, one process per fold, and writes the
+    mean drop in test AUC when each feature is shuffled to feature_importance/<name>.json'''
+    from sklearn.model_selection import StratifiedKFold
+    start = time.perf_counter()
+    folder = feature_matrix(name)
+    X, y, features = open_matrix(folder)
+    folds = list(StratifiedKFold(n_splits=FOLDS, shuffle=True, random_state=SEED).split(np.zeros(len(y)), y))
+
+    #one process per fold; cores beyond the fold count go to growing the trees
+    workers = workers or os.cpu_count() or 1
+    tree_jobs = max(workers // FOLDS, 1)
+    with ProcessPoolExecutor(max_workers=min(workers, FOLDS)) as pool:
+        results = list(pool.map(_score_fold, [folder] * FOLDS, [f[0] for f in folds], [f[1] for f in folds], [tree_jobs] * FOLDS))
+
+    aucs = np.array([auc for auc, _ in results])
+    importances = np.concatenate([imp for _, imp in results], axis=1)
+    scores = {'dataset': name, 'source': os.path.basename(dataset_source(name)[0]), 'rows': int(len(y)),
+              'folds': FOLDS, 'repeats': REPEATS, 'auc': float(aucs.mean()), 'auc_std': float(aucs.std()),
+              'workers': workers, 'seconds': round(time.perf_counter() - start, 2),
+              'features': sorted([{'feature': f, 'importance': float(importances[i].mean()), 'std': float(importances[i].std())}
+                                  for i, f in enumerate(features)], key=lambda s: -s['importance'])}
+    os.makedirs(IMPORTANCE_DIR, exist_ok=True)
+    with open(importance_path(name), "w") as f:
+        json.dump(scores, f, indent=1)
+    return scores
+
+
+def read_scores(name):
+    '''Returns the written scores of a dataset, or None when it was never trained'''
+    if not os.path.exists(importance_path(name)):
+        return None
+    with open(importance_path(name)) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    #usage: python feature_importance.py [dataset ...] [workers=N]
+    #datasets are census (ERSAtlas_CensusData.csv) and atlas<year> (MI_food_atlas<year>.csv), both by default
+    names = [a for a in sys.argv[1:] if not a.startswith("workers=")] or ['census', 'atlas2019']
+    workers = [int(a[len("workers="):]) for a in sys.argv[1:] if a.startswith("workers=")]
+    for name in names:
+        scores = train(name, workers[0] if workers else None)
+        print("%s: %d rows, AUC %.3f +/- %.3f, %.1fs on %d workers" % (name, scores['rows'], scores['auc'], scores['auc_std'], scores['seconds'], scores['workers']))
+        for s in scores['features']:
+            print("  %-20s %.4f +/- %.4f" % (s['feature'], s['importance'], s['std']))
@@ -1,31 +1,25 @@
 
 #importing packages
 import streamlit as st
-import pandas as pd
 import numpy as np
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import altair as alt
 import seaborn as sns
-from vega_datasets import data
 
-#reading in data
-atlas_census_data = pd.read_csv("ERSAtlas_CensusData.csv")
+from rollup_cube import load_state_level
+from state_topology import US_ATLAS_URL, load_topology, state_fips
 
 ############## MANIPULATING DATA ##############
-#getting state level information into df
-state_level = atlas_census_data.groupby(["State", "region", "food_desert_label"]).aggregate({"food_desert_label":"sum", "MedianIncome":"median", "Walk": "mean", "TotalPop": "sum", "ChildPoverty": "mean", "Service": "mean", "Construction":"mean", "Hispanic":"sum", "Asian":"sum", "White":"sum", "Black":"sum", "Native":"sum", "Pacific":"sum"})
-state_level = state_level.rename(columns={"food_desert_label": "FoodDesert_Totals"})
-state_level = state_level.reset_index()
-state_level = state_level.rename(columns={"region": "Region"})
+#getting state level information into df from the rollup cube built out of ERSAtlas_CensusData.csv
+state_level = load_state_level("ERSAtlas_CensusData.csv")
 
-#getting vega dataset just for map element
-state_pop = data.population_engineers_hurricanes()[['state', 'id', 'population']]
-state_map = alt.topo_feature(data.us_10m.url, 'states')
-state_pop = state_pop.rename(columns={'state':"State"})
+#bundled states topology (the us-atlas states when states.topo.json is not built) and State -> FIPS id table just for map element
+topology = load_topology()
+state_map = alt.Data(values=topology, format=alt.DataFormat(type='topojson', feature='states')) if topology is not None else alt.topo_feature(US_ATLAS_URL, 'states')
 
 #final state level data
-final_state_level  = state_pop[["State", "id"]].merge(state_level, how="inner", on="State")
+final_state_level  = state_fips().merge(state_level, how="inner", on="State")
 
 ############## PAGE FEATURES ##############
 #adding page features
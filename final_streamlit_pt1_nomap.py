@@ -1,7 +1,6 @@
 
 #importing packages
 import streamlit as st
-import pandas as pd
 import numpy as np
 import geopandas as gpd
 import matplotlib.pyplot as plt
@@ -9,15 +8,12 @@ import altair as alt
 import seaborn as sns
 #from vega_datasets import data
 
-#reading in data
-atlas_census_data = pd.read_csv("ERSAtlas_CensusData.csv")
+from rollup_cube import load_state_level
 
 ############## MANIPULATING DATA ##############
-#getting state level information into df
-state_level = atlas_census_data.groupby(["State", "region", "food_desert_label"]).aggregate({"food_desert_label":"sum", "MedianIncome":"median", "Walk": "mean", "TotalPop": "sum", "ChildPoverty": "mean", "Service": "mean", "Construction":"mean", "Hispanic":"sum", "Asian":"sum", "White":"sum", "Black":"sum", "Native":"sum", "Pacific":"sum"})
-state_level = state_level.rename(columns={"food_desert_label": "FoodDesert_Totals"})
-state_level = state_level.reset_index()
-final_state_level = state_level.rename(columns={"region": "Region"})
+#getting state level information into df from the rollup cube built out of ERSAtlas_CensusData.csv
+state_level = load_state_level("ERSAtlas_CensusData.csv")
+final_state_level = state_level
 
 # #getting vega dataset just for map element
 # state_pop = data.population_engineers_hurricanes()[['state', 'id', 'population']]
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import altair as alt
+import pandas as pd
+
+#latest GeoDataset of each geography, looked up by geography name
+geo_registry = {}
+
+#dataset name -> values for every geometry and attribute table charts may reference.
+#names carry a hash of their content, so charts built earlier keep pointing at their own data
+named_datasets = OrderedDict()
+MAX_DATASETS = 64
+#sessions register and read datasets at the same time
+_datasets_lock = threading.Lock()
+
+
+class MissingDatasetError(KeyError):
+    '''A chart references a dataset that is no longer registered, dropped as the least
+    recently used past MAX_DATASETS; the chart has to be built again'''
+
+
+def _content_name(prefix, name, values):
+    '''Names a dataset after its geography and a hash of its values'''
+    digest = hashlib.md5(json.dumps(values, separators=(',', ':')).encode('utf-8')).hexdigest()[:12]
+    return '%s-%s-%s' % (prefix, name.replace(' ', '_'), digest)
+
+
+class GeoDataset(object):
+    '''Holds one geography's tract geometry as GeoJSON features that carry only the
+    join key, plus a single attribute table that charts join their columns from.
+
+    Charts reference both by name, and chart_spec puts each into the spec's top level
+    datasets once however many charts on the page use them.'''
+
+    def __init__(self, name, frame, columns, key='CensusTract'):
+        self.name = name
+        self.key = key
+        self.columns = [c for c in columns if c != key]
+        geometry = json.loads(frame[[key, frame.geometry.name]].to_json(drop_id=True))['features']
+        self.features = [{'type': 'Feature', 'geometry': f['geometry'], 'properties': {key: f['properties'][key]}} for f in geometry]
+        self.attributes = json.loads(pd.DataFrame(frame[[key] + self.columns]).to_json(orient='records'))
+        self.geometry_name = _content_name('geometry', name, self.features)
+        self.attributes_name = _content_name('attributes', name, self.attributes)
+
+    def chart(self, columns):
+        '''Returns a chart over the geometry with only the given attribute columns joined in'''
+        columns = [c for c in columns if c != self.key]
+        return alt.Chart(alt.Data(name=self.geometry_name)).transform_lookup(
+            lookup='properties.' + self.key,
+            from_=alt.LookupData(alt.Data(name=self.attributes_name), self.key, columns))
+
+
+def register_geography(name, frame, columns, key='CensusTract'):
+    '''Builds the GeoDataset for a geography, keeping only the attribute columns
+    its charts encode, and stores it under name'''
+    geo = GeoDataset(name, frame, columns, key)
+    geo_registry[name] = geo
+    for dataset_name, values in [(geo.geometry_name, geo.features), (geo.attributes_name, geo.attributes)]:
+        _store(dataset_name, values)
+    return geo
+
+
+def _store(dataset_name, values):
+    with _datasets_lock:
+        named_datasets[dataset_name] = values
+        named_datasets.move_to_end(dataset_name)
+        while len(named_datasets) > MAX_DATASETS:
+            named_datasets.popitem(last=False)
+
+
+def register_topology(name, topology, feature):
+    '''Stores a TopoJSON topology as a named dataset and returns the chart data that
+    draws one of its objects, so the browser reads it from the spec instead of a URL'''
+    dataset_name = _content_name('topology', name, topology)
+    _store(dataset_name, topology)
+    return alt.Data(name=dataset_name, format=alt.DataFormat(type='topojson', feature=feature))
+
+
+def geography(name):
+    '''Returns a registered GeoDataset'''
+    return geo_registry[name]
+
+
+def _named_data(spec, names):
+    '''Collects the names of every named data source referenced in a spec'''
+    if isinstance(spec, dict):
+        if 'name' in spec and set(spec) <= {'name', 'format'}:
+            names.add(spec['name'])
+        for value in spec.values():
+            _named_data(value, names)
+    elif isinstance(spec, list):
+        for value in spec:
+            _named_data(value, names)
+    return names
+
+
+def chart_spec(chart):
+    '''Returns the Vega-Lite dict for chart with the geometry and attribute tables
+    it references added to the top level datasets exactly once. Raises MissingDatasetError
+    when one of them is no longer registered, rather than sending a map without its data'''
+    spec = chart.to_dict()
+    datasets = spec.setdefault('datasets', {})
+    with _datasets_lock:
+        for name in _named_data(spec, set()):
+            if name in datasets:
+                continue
+            if name not in named_datasets:
+                raise MissingDatasetError(name)
+            datasets[name] = named_datasets[name]
+            named_datasets.move_to_end(name)
+    return spec
+
+
+def spec_bytes(spec):
+    '''Returns the size in bytes of a Vega-Lite spec as sent to the browser'''
+    if not isinstance(spec, dict):
+        spec = chart_spec(spec)
+    return len(json.dumps(spec, separators=(',', ':')).encode('utf-8'))
@@ -1,14 +1,33 @@
-import geopandas as gpd
 import os
+import sys
 import pandas as pd
 import altair as alt
-import json
-import numpy as np
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import matplotlib.pyplot as plt
 import seaborn as sns
-from vega_datasets import data
 
+from data_cache import cached_frame, cache_report, input_signature, release, shared_frames
+from lila_rules import LilaRule, RuleInputs, evaluate_rule, food_desert_labels
+from tract_store import available_states, load_state_tracts, store_files
+from map_lod import build_pyramid, level_for_chart
+from geo_datasets import MissingDatasetError, chart_spec, register_geography, register_topology, spec_bytes
+from county_index import CountyIndex
+from anchor_points import anchor_points
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from atlas_years import MISSING_STATUS, STATUS_CHANGES, YearTable, atlas_path, available_years, read_year
+from rollup_cube import CUBE_PATH, load_state_level
+from load_scheduler import LoadTask, run_loads
+from tract_graph import CLUSTER_COLUMNS, HOT_SPOT_CLASSES, cluster_statistics, contiguity_graph
+from state_topology import STATE_FIPS_PATH, TOPOLOGY_PATH, US_ATLAS_URL, load_topology, state_fips
+from national_tiles import NATIONAL_FOOD_ATLAS_PATH, TILE_COLUMNS, NationalTiles
+from page_registry import build_page, forget, forget_page, memoized, page_loads, page_names, register_page
+from memory_report import record_session, session_sizes, shared_report
+from perf_spans import span, start_rerun, stop_rerun, to_jsonl
+from server_transforms import regression_lines, sum_rows
+from tract_keys import merge_join
+from feature_importance import importance_path, read_scores
+from spec_artifacts import artifact_key, read_manifest, read_specs, remove_stale, write_manifest, write_specs
 
 
 ROOT_DIR = os.path.dirname(__file__)
@@ -22,428 +41,783 @@ COMBINED_DATA_PATH = os.path.join(ROOT_DIR, ERSAtlas_CensusData_FILE_NAME)
 FOOD_ATLAS_PATH = os.path.join(ROOT_DIR, FOOD_ATLAS_NAME)
 CENSUS_TRACT_PATH = os.path.join(ROOT_DIR, CENSUS_TRACT_NAME)
 
+#only the Michigan partition of the tract store is read (see tract_store.py)
+MI_STATEFP = 26
+MI_TRACT_FILES = store_files([MI_STATEFP], shapefile_path=CENSUS_TRACT_PATH)
 
-#reading in data
-atlas_census_data = pd.read_csv(COMBINED_DATA_PATH)
+#attribute columns the tract maps colour by, the only ones sent to the browser
+MAP_COLUMNS = ['food_desert_label', 'TractSNAP', 'TractSeniors', 'PovertyRate']
 
-############## MANIPULATING DATA ##############
-#getting state level information into df
-state_level = atlas_census_data.groupby(["State", "region", "food_desert_label"]).aggregate({"food_desert_label":"sum", "MedianIncome":"median", "Walk": "mean", "TotalPop": "sum", "ChildPoverty": "mean", "Service": "mean", "Construction":"mean", "Hispanic":"sum", "Asian":"sum", "White":"sum", "Black":"sum", "Native":"sum", "Pacific":"sum"})
-state_level = state_level.rename(columns={"food_desert_label": "FoodDesert_Totals"})
-state_level = state_level.reset_index()
-state_level = state_level.rename(columns={"region": "Region"})
+#'server' sums the race columns per state and fits the Home regression lines in pandas (see server_transforms.py),
+#and sends the scatter only the columns it encodes; 'client' sends every row and leaves the transforms to Vega-Lite
+HOME_TRANSFORMS = 'server'
+RACE_COLUMNS = ["Hispanic", "White", "Black", "Native", "Asian", "Pacific"]
 
-#getting vega dataset just for map element
-state_pop = data.population_engineers_hurricanes()[['state', 'id', 'population']]
-state_map = alt.topo_feature(data.us_10m.url, 'states')
-state_pop = state_pop.rename(columns={'state':"State"})
+#atlas years found next to the app; 2019 is the one the tract geometry is merged with
+BASE_YEAR = 2019
+MI_YEARS = sorted(set(available_years('MI', ROOT_DIR)) | {BASE_YEAR})
+MI_YEAR_FILES = [atlas_path(year, 'MI', ROOT_DIR) for year in MI_YEARS]
 
-#final state level data
-final_state_level  = state_pop[["State", "id"]].merge(state_level, how="inner", on="State")
+#feature importance scores written by feature_importance.py, for the census data and every atlas year
+IMPORTANCE_DATASETS = ['census'] + ['atlas%d' % year for year in MI_YEARS]
+IMPORTANCE_FILES = [importance_path(name) for name in IMPORTANCE_DATASETS]
 
-############## PAGE FEATURES ##############
-#adding page features
-st.markdown('<style>body{background-color: Black;color: White}</style>',unsafe_allow_html=True)
 
-############## CREATING VISUALIZATIONS ##############
-#adding click feature
-click = alt.selection_multi(fields=['State'])
-
-#combined scatter plot
-scatter_plot = alt.Chart(final_state_level
-).mark_point(filled=True, stroke="white", strokeWidth=0.5).encode(
-    x=alt.X("MedianIncome:Q", scale=alt.Scale(domain=[35000, 115000]), axis=alt.Axis(title="Median Income", gridOpacity=0.1)),
-    y=alt.Y("Walk:Q", axis=alt.Axis(gridOpacity=0.1)),
-    size=alt.Size("TotalPop:Q", legend=alt.Legend(title="Total Population", symbolFillColor = "gray")),
-    color=alt.Color("food_desert_label:N", legend=alt.Legend(title="Food Desert Label")),
-    tooltip = ["State:N", "MedianIncome:Q", "FoodDesert_Totals:Q", "Region:N"],
-    opacity=alt.condition(click, alt.value(1), alt.value(0.2))
-).properties(
-    width=800
-).add_selection(click)
-
-#no food desert regression line
-no_regline = alt.Chart(final_state_level).transform_filter(
-    alt.datum.food_desert_label == 0
-).transform_regression(
-    "MedianIncome", "Walk"
-).mark_line(opacity=0.3).encode(
-    x=alt.X("MedianIncome:Q"),
-    y=alt.Y("Walk:Q")
-)
-
-#yes food desert regression line
-yes_regline = alt.Chart(final_state_level).transform_filter(
-    alt.datum.food_desert_label == 1
-).transform_regression(
-    "MedianIncome", "Walk"
-).mark_line(opacity=0.3, color="orange").encode(
-    x=alt.X("MedianIncome:Q"),
-    y=alt.Y("Walk:Q")
-)
-
-#combining reglines
-reglines = no_regline+yes_regline
-
-#combining scatter plot and reglines
-final_plot = scatter_plot+reglines
-
-#creating bar chart
-mini_bar = alt.Chart(final_state_level).transform_fold(
-    ["Hispanic", "White", "Black", "Native", "Asian", "Pacific"],
-    as_=["Race", "values"]
-).mark_bar().encode(
-    y = alt.Y("Race:N"),
-    x=alt.X("values:Q", axis=alt.Axis(title="Count of Population", tickCount=5)),
-    color=alt.Color("food_desert_label:N")
-).properties(
-    height = 175
-).transform_filter(click)
-
-#creating map
-mini_map = (alt.Chart(state_map).mark_geoshape().transform_lookup(
-    lookup = "id",
-    from_=alt.LookupData(final_state_level, "id", ["State", "Region", "TotalPop", "ChildPoverty", "FoodDesert_Totals"])
-).encode(
-    color=alt.Color("FoodDesert_Totals:Q", legend=alt.Legend(title="Food Desert Totals")),
-    opacity = alt.condition(click, alt.value(1), alt.value(0.1)),
-    tooltip = alt.Tooltip(["State:N", "Region:N", "TotalPop:Q"])
-).add_selection(click
-).project(type='albersUsa')).properties(
-    width = 250,
-    height=250
-)
-
-#combining map and bar
-bar_map = mini_bar| mini_map
-
-#combining bar and scatter
-combined_visuals = alt.vconcat(bar_map, final_plot)
-
-#adding final configurations
-final_combined_visuals = combined_visuals.configure(background='Black'
-).configure_axisLeft(
-    labelColor='white',
-    titleColor='white'
-).configure_axisRight(
-    labelColor='white',
-    titleColor='white'
-).configure_axisBottom(
-    labelColor='white',
-    titleColor='white'
-).configure_axisTop(
-    labelColor='black',
-    titleColor = 'white'
-).configure_legend(
-    labelColor='white',
-    titleColor='white'
-)
-
-d = {'Region': ['SouthWest', 'SouthEast', 'MidWest', 'Pacific', 'NonContiguous', 'DC', 'NorthEast', 'RockyMountains'], 'Percentage': [39.12, 36.21, 30.4, 28.39, 20.48, 30.16, 18.49, 29.02]}
-
-regions_df = pd.DataFrame(data = d)
-
-selection = alt.selection_single()
-regions_chart = alt.Chart(regions_df).mark_bar().encode(
-    # encode x as the percent, and hide the axis
-    x = alt.X('Percentage:Q', title = "Percentage of Food Tracks"),
-    y=alt.Y('Region'),
-    tooltip = [alt.Tooltip('Percentage:Q'),
-               alt.Tooltip('Region:N')
-              ],
-    color=alt.condition(selection, 'Percentage:Q', alt.value('grey'))
-).add_selection(selection)
-
-
-
-#Downloading Atlas and geodata
-
-census_tracts2019 = gpd.read_file(CENSUS_TRACT_PATH)
-census_tracts2019['STATEFP'] = pd.to_numeric(census_tracts2019['STATEFP'])
-census_tracts2019['GEOID'] = pd.to_numeric(census_tracts2019['GEOID'])
-
-MI_census_tracts2019 = census_tracts2019[census_tracts2019['STATEFP'] == 26]
-
-
-
-
-def food_desert_label(row):
-    '''This function lables a tract as a food desert if it falls under 1 of 4
-    measures as determined by the USDA ERS Atlas'''
-    if row['LILATracts_1And10'] == 1:
-        return 1
-    if row['LILATracts_halfAnd10'] == 1:
-        return 1
-    if row['LILATracts_1And20'] == 1:
-        return 1
-    if row['LILATracts_Vehicle'] == 1:
-        return 1
-    else:
-        return 0
+############## LOADING DATA ##############
 
+def build_final_state_level(state_level):
+    '''Joins the state level data to the state FIPS ids used by the map'''
+    #bundled State -> FIPS id table (see state_topology.py)
+    return state_fips().merge(state_level, how="inner", on="State")
 
 
-MI_food_atlas2019 = pd.read_csv(FOOD_ATLAS_PATH)
+def load_state_data():
+    '''Returns the state level frame behind the Home page'''
+    #getting state level information from the rollup cube (see rollup_cube.py), only read when the final frame is rebuilt
+    state_level = lambda: cached_frame("state_level", [COMBINED_DATA_PATH, CUBE_PATH], lambda: load_state_level(COMBINED_DATA_PATH), version="cube", keep=False)
 
-MI_food_atlas2019['food_desert_label'] = MI_food_atlas2019.apply(lambda row: food_desert_label(row), axis=1)
+    #final state level data
+    return cached_frame("final_state_level", [COMBINED_DATA_PATH, CUBE_PATH, STATE_FIPS_PATH], lambda: build_final_state_level(state_level()), version="fips")
 
-# Merge atlas and geodataframe
-MI_censustract_df_merged_2019 = MI_census_tracts2019.merge(MI_food_atlas2019, left_on='GEOID', right_on='CensusTract', how='inner')
-MI_censustract_df_merged_2019 = MI_censustract_df_merged_2019[['geometry', 'CensusTract', 'TractSNAP', 'food_desert_label', 'County', 'TractSeniors', 'PovertyRate']]
 
+def load_home_transforms():
+    '''Returns the race columns summed per state and label, and the end points of the
+    Walk on MedianIncome regression line of each label, cached like the state level data'''
+    final_state_level = load_state_data()
+    paths = [COMBINED_DATA_PATH, CUBE_PATH, STATE_FIPS_PATH]
+    race_rows = cached_frame("home_race_rows", paths, lambda: sum_rows(final_state_level, RACE_COLUMNS, ["State", "food_desert_label"]))
+    reglines = cached_frame("home_reglines", paths, lambda: regression_lines(final_state_level, "MedianIncome", "Walk", "food_desert_label"))
+    return race_rows, reglines
+
+
+def load_atlas(path, columns):
+    '''Reads the columns of an atlas CSV the app uses with compact dtypes (see atlas_schema.py)'''
+    atlas = read_atlas(path, columns)
+    print("%s: %d columns, %.1f MB in memory" % (os.path.basename(path), atlas.shape[1], atlas.memory_usage(deep=True).sum() / 1e6))
+    return atlas
 
 
-# load as a GeoJSON object.
-json_features = json.loads(MI_censustract_df_merged_2019.to_json())
-data_geo = alt.Data(values=json_features['features'])
+def load_food_atlas():
+    '''Reads the Michigan food atlas and labels each tract as a food desert or not'''
+    MI_food_atlas2019 = load_atlas(FOOD_ATLAS_PATH, FOOD_ATLAS_COLUMNS)
+    with span('food_desert_labels'):
+        MI_food_atlas2019['food_desert_label'] = food_desert_labels(MI_food_atlas2019)
+    return MI_food_atlas2019
 
-points = []
-for tract in json_features['features']:
-    first_point = tract['geometry']['coordinates'][0][0]
-    points.append(first_point)
-points_df = pd.DataFrame(np.vstack(points))
 
-chart_points = alt.Chart(points_df).mark_point(opacity = 0).encode(
-    longitude='0:Q',
-    latitude='1:Q'
-    )
+def build_merged_tracts(MI_census_tracts2019, MI_food_atlas2019):
+    '''Joins the Michigan tract geometries with the food atlas on their int64 GEOIDs'''
+    with span('merge'):
+        MI_censustract_df_merged_2019 = merge_join(MI_census_tracts2019[['GEOID', 'geometry']], MI_food_atlas2019[
+            ['CensusTract', 'TractSNAP', 'food_desert_label', 'County', 'TractSeniors', 'PovertyRate']], 'GEOID', 'CensusTract')
+    #merge_join returns rows in tract order, so every county is one contiguous block of rows (see county_index.py)
+    return MI_censustract_df_merged_2019[['geometry', 'CensusTract', 'TractSNAP', 'food_desert_label', 'County', 'TractSeniors', 'PovertyRate']]
+
 
+def load_year_atlas(year):
+    '''Reads one year of the Michigan food atlas with its food desert labels'''
+    if year == BASE_YEAR:
+        return cached_frame("MI_food_atlas2019", [FOOD_ATLAS_PATH], load_food_atlas, version="schema")
+    return cached_frame("MI_food_atlas%d" % year, [atlas_path(year, 'MI', ROOT_DIR)], lambda: read_year(atlas_path(year, 'MI', ROOT_DIR)), version="schema")
 
-##Creating ALtair visualizations
 
-SNAP_vis = alt.Chart(data_geo).mark_geoshape(
+def load_year_table(MI_censustract_df_merged_2019):
+    '''Holds the map columns of every atlas year for the merged Michigan tracts (see atlas_years.py)'''
+    return cached_frame("MI_atlas_years", MI_TRACT_FILES + MI_YEAR_FILES, lambda: YearTable(
+        MI_censustract_df_merged_2019['CensusTract'], {year: load_year_atlas(year) for year in MI_YEARS}, MAP_COLUMNS), version="years")
 
-    stroke='white'
-).properties(
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.TractSNAP:Q', title = 'Number on SNAP' ))
+def load_michigan_tracts():
+    '''Reads the Michigan tract geometries'''
+    return cached_frame("MI_census_tracts2019", MI_TRACT_FILES, lambda: load_state_tracts([MI_STATEFP], shapefile_path=CENSUS_TRACT_PATH))
 
-interactive_state_snap= SNAP_vis.encode(
-    tooltip=[alt.Tooltip('properties.TractSNAP:N', title='Number on SNAP'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
 
-)
+def load_michigan_data(whatif_rule=None, year=None):
+    '''Loads the Michigan tracts merged with the food atlas of the given year (2019 by
+    default), relabelled under the what-if rule when one is given, and the simplified
+    geometry levels of the maps'''
+    MI_food_atlas2019 = load_year_atlas(BASE_YEAR)
 
-label_vis = alt.Chart(data_geo).mark_geoshape(
+    # Merge atlas and geodataframe; the tract geometries are only read to rebuild it, then released
+    MI_censustract_df_merged_2019 = cached_frame("MI_censustract_df_merged_2019", MI_TRACT_FILES + [FOOD_ATLAS_PATH],
+                                                 lambda: build_merged_tracts(load_michigan_tracts(), MI_food_atlas2019), version="sorted")
+    release("MI_census_tracts2019")
 
-    stroke='white'
-).properties(
+    #simplified geometry levels, each map uses the coarsest one that looks the same at its size (see map_lod.py)
+    MI_lod_pyramid = cached_frame("MI_lod_pyramid", MI_TRACT_FILES + [FOOD_ATLAS_PATH], lambda: build_pyramid(MI_censustract_df_merged_2019), version="sorted")
+
+    #another atlas year: the same tract geometry with that year's map columns
+    if year is not None and year != BASE_YEAR:
+        year_frame = load_year_table(MI_censustract_df_merged_2019).year(year).set_axis(MI_censustract_df_merged_2019.index)
+        MI_censustract_df_merged_2019 = MI_censustract_df_merged_2019.assign(**{c: year_frame[c] for c in MAP_COLUMNS})
+        MI_food_atlas2019 = load_year_atlas(year)
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.food_desert_label:N', title = 'Food Desert Label' ))
+    #what-if: relabel every Michigan tract under a custom low income / low access definition
+    if whatif_rule is not None:
+        with span('what-if relabel'):
+            whatif_labels = pd.Series(evaluate_rule(RuleInputs(MI_food_atlas2019), whatif_rule).astype(int), index=MI_food_atlas2019['CensusTract'])
+            MI_censustract_df_merged_2019 = MI_censustract_df_merged_2019.assign(
+                #a tract the atlas year does not have stays unlabelled, like it does on that year's map
+                food_desert_label=MI_censustract_df_merged_2019['CensusTract'].map(whatif_labels).astype('Int8').values)
 
-interactive_label_state = label_vis.encode(
-    tooltip=[alt.Tooltip('properties.food_desert_label:N', title='Food Desert Label'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+    return MI_censustract_df_merged_2019, MI_lod_pyramid
 
-)
 
-Seniors_vis = alt.Chart(data_geo).mark_geoshape(
+def load_tasks():
+    '''Every input a page can preload, as tasks naming the loads they wait for'''
+    atlas_tasks = ['MI_food_atlas%d' % year for year in MI_YEARS]
+    tasks = [LoadTask('state_level', load_state_data), LoadTask('MI_census_tracts2019', load_michigan_tracts)]
+    tasks += [LoadTask(name, lambda year=year: load_year_atlas(year)) for name, year in zip(atlas_tasks, MI_YEARS)]
+    tasks.append(LoadTask('MI_censustract_df_merged_2019', load_michigan_data, ['MI_census_tracts2019', 'MI_food_atlas%d' % BASE_YEAR]))
+    if len(MI_YEARS) > 1:
+        tasks.append(LoadTask('MI_atlas_years', lambda: load_year_table(load_michigan_data()[0]), ['MI_censustract_df_merged_2019'] + atlas_tasks))
+    return tasks
+
+
+def preload_inputs(page):
+    '''Loads the inputs the page's builders read (and what those wait for), reading the
+    independent files concurrently, and returns the report of where the time went (see
+    load_scheduler.py); None for a page without inputs'''
+    tasks = {task.name: task for task in load_tasks()}
+    #a load missing from the tasks (the year table with a single atlas year) is not needed
+    wanted, stack = set(), [name for name in page_loads(page) if name in tasks]
+    while stack:
+        name = stack.pop()
+        if name not in wanted:
+            wanted.add(name)
+            stack.extend(tasks[name].deps)
+    if not wanted:
+        return None
+    _, report = run_loads([task for name, task in tasks.items() if name in wanted])
+    print(report.format())
+    return report
 
-    stroke='white'
-).properties(
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.TractSeniors:Q', title = 'Number of Seniors' )).encode(
-    tooltip=[alt.Tooltip('properties.TractSeniors:Q', title='Number of Seniors'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+############## CREATING VISUALIZATIONS ##############
+
+def build_home_charts(whatif_rule=None, year=None):
+    '''Builds the national scatter, bar and map combo and the regions chart'''
+    final_state_level = load_state_data()
+
+    #bundled states topology for the map element, sent inside the spec rather than fetched from a CDN
+    topology = load_topology()
+
+    #adding click feature
+    click = alt.selection_multi(fields=['State'])
+
+    #server side transforms: the scatter and map share the columns they encode, the bar and lines get their results
+    scatter_rows, race_rows = final_state_level, final_state_level
+    if HOME_TRANSFORMS == 'server':
+        with span('home transforms'):
+            race_rows, regline_ends = load_home_transforms()
+        scatter_rows = final_state_level[["id", "State", "Region", "food_desert_label", "MedianIncome", "Walk", "TotalPop", "ChildPoverty", "FoodDesert_Totals"]]
+
+    #combined scatter plot
+    scatter_plot = alt.Chart(scatter_rows
+    ).mark_point(filled=True, stroke="white", strokeWidth=0.5).encode(
+        x=alt.X("MedianIncome:Q", scale=alt.Scale(domain=[35000, 115000]), axis=alt.Axis(title="Median Income", gridOpacity=0.1)),
+        y=alt.Y("Walk:Q", axis=alt.Axis(gridOpacity=0.1)),
+        size=alt.Size("TotalPop:Q", legend=alt.Legend(title="Total Population", symbolFillColor = "gray")),
+        color=alt.Color("food_desert_label:N", legend=alt.Legend(title="Food Desert Label")),
+        tooltip = ["State:N", "MedianIncome:Q", "FoodDesert_Totals:Q", "Region:N"],
+        opacity=alt.condition(click, alt.value(1), alt.value(0.2))
+    ).properties(
+        width=800
+    ).add_selection(click)
+
+    if HOME_TRANSFORMS == 'server':
+        #regression lines as their fitted end points
+        no_regline = alt.Chart(regline_ends[regline_ends["food_desert_label"] == 0]).mark_line(opacity=0.3).encode(
+            x=alt.X("MedianIncome:Q"),
+            y=alt.Y("Walk:Q")
+        )
+        yes_regline = alt.Chart(regline_ends[regline_ends["food_desert_label"] == 1]).mark_line(opacity=0.3, color="orange").encode(
+            x=alt.X("MedianIncome:Q"),
+            y=alt.Y("Walk:Q")
+        )
+    else:
+        #no food desert regression line
+        no_regline = alt.Chart(final_state_level).transform_filter(
+            alt.datum.food_desert_label == 0
+        ).transform_regression(
+            "MedianIncome", "Walk"
+        ).mark_line(opacity=0.3).encode(
+            x=alt.X("MedianIncome:Q"),
+            y=alt.Y("Walk:Q")
+        )
+
+        #yes food desert regression line
+        yes_regline = alt.Chart(final_state_level).transform_filter(
+            alt.datum.food_desert_label == 1
+        ).transform_regression(
+            "MedianIncome", "Walk"
+        ).mark_line(opacity=0.3, color="orange").encode(
+            x=alt.X("MedianIncome:Q"),
+            y=alt.Y("Walk:Q")
+        )
+
+    #combining reglines
+    reglines = no_regline+yes_regline
+
+    #combining scatter plot and reglines
+    final_plot = scatter_plot+reglines
+
+    #creating bar chart
+    mini_bar = alt.Chart(race_rows).transform_fold(
+        RACE_COLUMNS,
+        as_=["Race", "values"]
+    ).mark_bar().encode(
+        y = alt.Y("Race:N"),
+        x=alt.X("values:Q", axis=alt.Axis(title="Count of Population", tickCount=5)),
+        color=alt.Color("food_desert_label:N")
+    ).properties(
+        height = 175
+    ).transform_filter(click)
+
+    #creating map, from the bundled topology inside the spec or the us-atlas states when it has not been built
+    state_map = register_topology('states', topology, 'states') if topology is not None else alt.topo_feature(US_ATLAS_URL, 'states')
+    mini_map = (alt.Chart(state_map).mark_geoshape().transform_lookup(
+        lookup = "id",
+        from_=alt.LookupData(scatter_rows, "id", ["State", "Region", "TotalPop", "ChildPoverty", "FoodDesert_Totals"])
+    ).encode(
+        color=alt.Color("FoodDesert_Totals:Q", legend=alt.Legend(title="Food Desert Totals")),
+        opacity = alt.condition(click, alt.value(1), alt.value(0.1)),
+        tooltip = alt.Tooltip(["State:N", "Region:N", "TotalPop:Q"])
+    ).add_selection(click
+    ).project(type='albersUsa')).properties(
+        width = 250,
+        height=250
+    )
+
+    #combining map and bar
+    bar_map = mini_bar| mini_map
+
+    #combining bar and scatter
+    combined_visuals = alt.vconcat(bar_map, final_plot)
+
+    #adding final configurations
+    final_combined_visuals = combined_visuals.configure(background='Black'
+    ).configure_axisLeft(
+        labelColor='white',
+        titleColor='white'
+    ).configure_axisRight(
+        labelColor='white',
+        titleColor='white'
+    ).configure_axisBottom(
+        labelColor='white',
+        titleColor='white'
+    ).configure_axisTop(
+        labelColor='black',
+        titleColor = 'white'
+    ).configure_legend(
+        labelColor='white',
+        titleColor='white'
+    )
+
+    d = {'Region': ['SouthWest', 'SouthEast', 'MidWest', 'Pacific', 'NonContiguous', 'DC', 'NorthEast', 'RockyMountains'], 'Percentage': [39.12, 36.21, 30.4, 28.39, 20.48, 30.16, 18.49, 29.02]}
 
-poverty_vis = alt.Chart(data_geo).mark_geoshape(
+    regions_df = pd.DataFrame(data = d)
 
-    stroke='white'
-).properties(
+    selection = alt.selection_single()
+    regions_chart = alt.Chart(regions_df).mark_bar().encode(
+        # encode x as the percent, and hide the axis
+        x = alt.X('Percentage:Q', title = "Percentage of Food Tracks"),
+        y=alt.Y('Region'),
+        tooltip = [alt.Tooltip('Percentage:Q'),
+                   alt.Tooltip('Region:N')
+                  ],
+        color=alt.condition(selection, 'Percentage:Q', alt.value('grey'))
+    ).add_selection(selection)
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.PovertyRate:Q', title = 'Poverty Rate' )).encode(
-    tooltip=[alt.Tooltip('properties.PovertyRate:Q', title='Poverty Rate'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+    return {'final_combined_visuals': final_combined_visuals, 'regions_chart': regions_chart}
 
-Wayne_County = MI_censustract_df_merged_2019[MI_censustract_df_merged_2019['County'] == 'Wayne County']
 
-wayne_json_gdf = Wayne_County.to_json()
-wayne_json_features = json.loads(wayne_json_gdf)
+def build_importance_chart(whatif_rule=None, year=None):
+    '''Builds the feature importance bars of every trained dataset, none when nothing was trained'''
+    rows = []
+    for name in IMPORTANCE_DATASETS:
+        scores = read_scores(name)
+        if scores is None:
+            continue
+        title = '%s (AUC %.2f)' % (scores['source'], scores['auc'])
+        rows += [dict(feature, dataset=title) for feature in scores['features']]
+    if not rows:
+        return {}
 
-wayne_points = []
-for tract_wayne in wayne_json_features['features']:
-    first_point_wayne = tract_wayne['geometry']['coordinates'][0][0]
-    wayne_points.append(first_point_wayne)
-wayne_points_df = pd.DataFrame(np.vstack(wayne_points))
+    importance_chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+        x=alt.X('importance:Q', title='Drop in AUC when shuffled'),
+        y=alt.Y('feature:N', sort='-x', title=None),
+        tooltip=[alt.Tooltip('feature:N'), alt.Tooltip('importance:Q', format='.4f'), alt.Tooltip('std:Q', format='.4f')]
+    ).properties(
+        width=500
+    ).facet(
+        row=alt.Row('dataset:N', title=None)
+    ).resolve_scale(y='independent')
+
+    return {'importance_chart': importance_chart}
+
+
+def build_state_maps(whatif_rule=None, year=None):
+    '''Builds the four statewide Michigan tract maps'''
+    MI_censustract_df_merged_2019, MI_lod_pyramid = load_michigan_data(whatif_rule, year)
+
+    # load as a GeoJSON object, registered once and shared by every statewide map
+    MI_state_df = level_for_chart(MI_censustract_df_merged_2019, MI_lod_pyramid)
+    with span('register_geography', 'geometry'):
+        MI_geo = register_geography('Michigan', MI_state_df, MAP_COLUMNS)
+
+    with span('anchor_points', 'geometry'):
+        points_df = anchor_points(MI_state_df.geometry)
+
+    chart_points = alt.Chart(points_df).mark_point(opacity = 0).encode(
+        longitude='lon:Q',
+        latitude='lat:Q'
+        )
+
+    SNAP_vis = MI_geo.chart(['TractSNAP']).mark_geoshape(
+
+        stroke='white'
+    ).properties(
+
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('TractSNAP:Q', title = 'Number on SNAP' ))
+
+    interactive_state_snap= SNAP_vis.encode(
+        tooltip=[alt.Tooltip('TractSNAP:N', title='Number on SNAP'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
 
-wayne_chart_points = alt.Chart(wayne_points_df).mark_point(opacity = 0).encode(
-    longitude='0:Q',
-    latitude='1:Q'
     )
 
-# load as a GeoJSON object.
+    label_vis = MI_geo.chart(['food_desert_label']).mark_geoshape(
 
-wayne_data_geo = alt.Data(values=wayne_json_features['features'])
+        stroke='white'
+    ).properties(
 
-wayne_label_vis = alt.Chart(wayne_data_geo).mark_geoshape(
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('food_desert_label:N', title = 'Food Desert Label' ))
 
-    stroke='white'
-).properties(
+    interactive_label_state = label_vis.encode(
+        tooltip=[alt.Tooltip('food_desert_label:N', title='Food Desert Label'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.food_desert_label:N', title = 'Food Desert Label' ))
+    )
 
-interactive_wayne_label_vis = wayne_label_vis.encode(
-    tooltip=[alt.Tooltip('properties.food_desert_label:N', title='Food Desert Label'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+    Seniors_vis = MI_geo.chart(['TractSeniors']).mark_geoshape(
 
-)
+        stroke='white'
+    ).properties(
 
-wayne_SNAP_vis = alt.Chart(wayne_data_geo).mark_geoshape(
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('TractSeniors:Q', title = 'Number of Seniors' )).encode(
+        tooltip=[alt.Tooltip('TractSeniors:Q', title='Number of Seniors'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
 
-    stroke='white'
-).properties(
+    poverty_vis = MI_geo.chart(['PovertyRate']).mark_geoshape(
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.TractSNAP:Q', title = 'Number on SNAP' ))
+        stroke='white'
+    ).properties(
 
-interactive_wayne_snap_vis = wayne_SNAP_vis.encode(
-    tooltip=[alt.Tooltip('properties.TractSNAP:N', title='Number on SNAP'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('PovertyRate:Q', title = 'Poverty Rate' )).encode(
+        tooltip=[alt.Tooltip('PovertyRate:Q', title='Poverty Rate'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
 
-)
+    return {'state_snap': interactive_state_snap + chart_points,
+            'state_label': interactive_label_state + chart_points,
+            'state_seniors': Seniors_vis + chart_points,
+            'state_poverty': poverty_vis + chart_points}
 
-wayne_seniors_vis = alt.Chart(wayne_data_geo).mark_geoshape(
 
-    stroke='white'
-).properties(
+def build_county_index(whatif_rule=None):
+    '''Indexes the row range of every county in the merged Michigan frame'''
+    MI_censustract_df_merged_2019, _ = load_michigan_data(whatif_rule)
+    return CountyIndex(MI_censustract_df_merged_2019)
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.TractSeniors:Q', title = 'Number of Seniors' ))
 
-interactive_wayne_seniors_vis = wayne_seniors_vis.encode(
-    tooltip=[alt.Tooltip('properties.TractSeniors:N', title='Number of Seniors'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+def build_county_maps(county_code, whatif_rule=None, year=None):
+    '''Builds the four tract maps of one county, picked by its 5 digit GEOID'''
+    MI_censustract_df_merged_2019, MI_lod_pyramid = load_michigan_data(whatif_rule, year)
+    county_index = memoized(build_county_index, DATA_KEY, whatif_rule)
 
-)
+    county_df = county_index.rows(MI_censustract_df_merged_2019, county_code)
 
-poverty_vis_wayne = alt.Chart(wayne_data_geo).mark_geoshape(
+    # load as a GeoJSON object.
+    county_df = level_for_chart(county_df, MI_lod_pyramid)
+    with span('register_geography', 'geometry'):
+        county_geo = register_geography(county_index.names[county_code], county_df, MAP_COLUMNS)
 
-    stroke='white'
-).properties(
+    with span('anchor_points', 'geometry'):
+        county_points_df = anchor_points(county_df.geometry)
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.PovertyRate:Q', title = 'Poverty Rate' )).encode(
-    tooltip=[alt.Tooltip('properties.PovertyRate:Q', title='Poverty Rate'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+    county_chart_points = alt.Chart(county_points_df).mark_point(opacity = 0).encode(
+        longitude='lon:Q',
+        latitude='lat:Q'
+        )
 
+    county_label_vis = county_geo.chart(['food_desert_label']).mark_geoshape(
 
-Washtenaw_County = MI_censustract_df_merged_2019[MI_censustract_df_merged_2019['County'] == 'Washtenaw County']
+        stroke='white'
+    ).properties(
 
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('food_desert_label:N', title = 'Food Desert Label' ))
 
-washtenaw_json_gdf = Washtenaw_County.to_json()
-washtenaw_json_features = json.loads(washtenaw_json_gdf)
-washtenaw_points = []
-for tract in washtenaw_json_features['features']:
-    first_point_washtenaw = tract['geometry']['coordinates'][0][0]
-    washtenaw_points.append(first_point_washtenaw)
-washtenaw_points_df = pd.DataFrame(np.vstack(washtenaw_points))
+    interactive_county_label_vis = county_label_vis.encode(
+        tooltip=[alt.Tooltip('food_desert_label:N', title='Food Desert Label'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
 
-washtenaw_chart_points = alt.Chart(washtenaw_points_df).mark_point(opacity = 0).encode(
-    longitude='0:Q',
-    latitude='1:Q'
     )
-# load as a GeoJSON object.
-washtenaw_json_features = json.loads(washtenaw_json_gdf)
 
-washtenaw_data_geo = alt.Data(values=washtenaw_json_features['features'])
+    county_SNAP_vis = county_geo.chart(['TractSNAP']).mark_geoshape(
+
+        stroke='white'
+    ).properties(
+
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('TractSNAP:Q', title = 'Number on SNAP' ))
 
-washtenawlabel_vis = alt.Chart(washtenaw_data_geo).mark_geoshape(
+    interactive_county_snap_vis = county_SNAP_vis.encode(
+        tooltip=[alt.Tooltip('TractSNAP:N', title='Number on SNAP'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
 
-    stroke='white'
-).properties(
+    )
+
+    county_seniors_vis = county_geo.chart(['TractSeniors']).mark_geoshape(
 
+        stroke='white'
+    ).properties(
 
-).encode(
-    color= alt.Color('properties.food_desert_label:N', title = 'Food Desert Label' ))
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('TractSeniors:Q', title = 'Number of Seniors' ))
 
-interactive_washtenawlabel_vis = washtenawlabel_vis.encode(
-    tooltip=[alt.Tooltip('properties.food_desert_label:N', title='Food Desert Label'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+    interactive_county_seniors_vis = county_seniors_vis.encode(
+        tooltip=[alt.Tooltip('TractSeniors:N', title='Number of Seniors'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
 
-)
+    )
 
-washtenaw_SNAP_vis = alt.Chart(washtenaw_data_geo).mark_geoshape(
+    poverty_vis_county = county_geo.chart(['PovertyRate']).mark_geoshape(
+
+        stroke='white'
+    ).properties(
+
+        width=500,
+        height=500
+    ).encode(
+        color= alt.Color('PovertyRate:Q', title = 'Poverty Rate' )).encode(
+        tooltip=[alt.Tooltip('PovertyRate:Q', title='Poverty Rate'),
+                alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+
+    return {'county_snap': interactive_county_snap_vis + county_chart_points,
+            'county_label': interactive_county_label_vis + county_chart_points,
+            'county_seniors': interactive_county_seniors_vis + county_chart_points,
+            'county_poverty': poverty_vis_county + county_chart_points}
+
+
+def build_national_tiles(whatif_rule=None, year=None):
+    '''Opens the national tract tile pyramid, when the national food atlas is present'''
+    if not os.path.exists(NATIONAL_FOOD_ATLAS_PATH) or not available_states():
+        return {}
+    return {'national_tiles': NationalTiles(NATIONAL_FOOD_ATLAS_PATH)}
+
+
+def build_status_maps(whatif_rule=None, year=None):
+    '''Maps how the food desert status of every Michigan tract changed between two atlas
+    years, given here as year=(first, last), next to the count of tracts per change'''
+    if year is None or len(MI_YEARS) < 2:
+        return {}
+    first, last = year
+    MI_censustract_df_merged_2019, MI_lod_pyramid = load_michigan_data()
+    status = load_year_table(MI_censustract_df_merged_2019).status_change(first, last)
+
+    #same geometry as the statewide maps, only the status column is added
+    MI_status_df = level_for_chart(MI_censustract_df_merged_2019, MI_lod_pyramid).assign(status_change=status)
+    with span('register_geography', 'geometry'):
+        status_geo = register_geography('Michigan status', MI_status_df, ['status_change'])
+
+    statuses = list(STATUS_CHANGES.values()) + [MISSING_STATUS]
+    status_scale = alt.Scale(domain=statuses, range=['#bab0ac', '#e45756', '#f58518', '#54a24b', '#eeeeee'])
+
+    status_map = status_geo.chart(['status_change']).mark_geoshape(
+        stroke='white'
+    ).encode(
+        color=alt.Color('status_change:N', scale=status_scale, title='%d to %d' % (first, last)),
+        tooltip=[alt.Tooltip('status_change:N', title='Status'),
+                 alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+    ).properties(
+        width=500,
+        height=500
+    )
 
-    stroke='white'
-).properties(
+    status_counts_df = pd.Series(status).value_counts().reindex(statuses, fill_value=0).rename_axis('status_change').reset_index(name='Tracts')
+    status_counts = alt.Chart(status_counts_df).mark_bar().encode(
+        x=alt.X('Tracts:Q', title='Number of Tracts'),
+        y=alt.Y('status_change:N', sort=statuses, title=None),
+        color=alt.Color('status_change:N', scale=status_scale, legend=None),
+        tooltip=['status_change:N', 'Tracts:Q']
+    ).properties(
+        width=250
+    )
+
+    return {'status_map': status_map, 'status_counts': status_counts}
+
+
+#titles of the columns tested for clusters on the hot spots page
+HOT_SPOT_TITLES = {'food_desert_label': 'Food Desert Label', 'TractSNAP': 'SNAP Benefits', 'TractSeniors': 'Number of Seniors', 'PovertyRate': 'Poverty Rate'}
+
+
+def build_hot_spot_maps(whatif_rule=None, year=None):
+    '''Maps the Getis-Ord Gi* hot and cold spots of every cluster column over the queen
+    contiguity graph of the Michigan tracts, next to each column's global Moran's I'''
+    MI_censustract_df_merged_2019, MI_lod_pyramid = load_michigan_data()
+
+    #the graph is built once from the full resolution tracts and kept as a sparse matrix in .cache (see tract_graph.py)
+    MI_tract_graph = cached_frame("MI_tract_graph", MI_TRACT_FILES + [FOOD_ATLAS_PATH],
+                                  lambda: contiguity_graph(MI_censustract_df_merged_2019.geometry.values, 'queen'), version="sorted")
+    with span('cluster statistics'):
+        hot_spots, morans = cluster_statistics(MI_tract_graph, MI_censustract_df_merged_2019)
+
+    MI_hot_spot_df = level_for_chart(MI_censustract_df_merged_2019, MI_lod_pyramid).assign(**{c: hot_spots[c].values for c in hot_spots})
+    with span('register_geography', 'geometry'):
+        hot_spot_geo = register_geography('Michigan hot spots', MI_hot_spot_df, list(hot_spots.columns))
+
+    hot_spot_scale = alt.Scale(domain=HOT_SPOT_CLASSES, range=['#b2182b', '#ef8a62', '#fddbc7', '#f7f7f7', '#d1e5f0', '#67a9cf', '#2166ac', '#bab0ac'])
+    charts = {}
+    for column in CLUSTER_COLUMNS:
+        charts['hot_spots_' + column] = hot_spot_geo.chart([column + '_hot_spot']).mark_geoshape(
+            stroke='white'
+        ).encode(
+            color=alt.Color(column + '_hot_spot:N', scale=hot_spot_scale, title=HOT_SPOT_TITLES[column]),
+            tooltip=[alt.Tooltip(column + '_hot_spot:N', title='Gi*'),
+                     alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')]
+        ).properties(
+            width=500,
+            height=500
+        )
+
+    morans['title'] = morans['column'].map(HOT_SPOT_TITLES)
+    charts['morans_chart'] = alt.Chart(morans).mark_bar().encode(
+        x=alt.X('morans_i:Q', title="Global Moran's I"),
+        y=alt.Y('title:N', title=None),
+        tooltip=[alt.Tooltip('title:N', title='Feature'), alt.Tooltip('morans_i:Q', format='.3f', title="Moran's I"),
+                 alt.Tooltip('z_score:Q', format='.1f', title='z score'), alt.Tooltip('p_value:Q', format='.2g', title='p value')]
+    ).properties(
+        width=500
+    )
+    return charts
+
+
+############## PAGES ##############
+#each sidebar option declares the builders it needs, only the selected page's builders run.
+#county maps are built per picked county in the page itself (see build_county_maps)
+#the loads each page names (see load_tasks) are read concurrently before its first build
+MAP_BUILDERS = [build_state_maps]
+MAP_LOADS = ['MI_censustract_df_merged_2019']
+register_page('Home', [build_home_charts, build_importance_chart], ['state_level'])
+register_page('Seniors', MAP_BUILDERS, MAP_LOADS)
+register_page('SNAP Benefits', MAP_BUILDERS, MAP_LOADS)
+register_page('Poverty', MAP_BUILDERS, MAP_LOADS)
+register_page('Status change', [build_status_maps], ['MI_atlas_years'])
+register_page('Hot spots', [build_hot_spot_maps], MAP_LOADS)
+register_page('National map', [build_national_tiles])
+register_page('Conclusion')
+
+#built charts are reused until one of the input files changes
+DATA_KEY = tuple(input_signature([COMBINED_DATA_PATH, CUBE_PATH, FOOD_ATLAS_PATH, NATIONAL_FOOD_ATLAS_PATH] + MI_TRACT_FILES + MI_YEAR_FILES + IMPORTANCE_FILES))
+
+#charts each page shows, as view name -> built charts placed side by side
+PAGE_VIEWS = {'Home': {'regions_chart': ['regions_chart'], 'final_combined_visuals': ['final_combined_visuals'],
+                       'importance_chart': ['importance_chart']},
+              'Seniors': {'state_seniors': ['state_label', 'state_seniors']},
+              'SNAP Benefits': {'state_snap': ['state_label', 'state_snap']},
+              'Poverty': {'state_poverty': ['state_label', 'state_poverty']},
+              'Status change': {'status_map': ['status_map', 'status_counts']},
+              'Hot spots': dict([('morans_chart', ['morans_chart'])] + [('hot_spots_' + c, ['hot_spots_' + c]) for c in CLUSTER_COLUMNS])}
+
+#county map each page shows next to the county's food desert label map
+COUNTY_VIEWS = {'Seniors': 'county_seniors', 'SNAP Benefits': 'county_snap', 'Poverty': 'county_poverty'}
+
+
+def default_year(page):
+    '''Returns the atlas year a page shows unless another is picked: the base year on
+    the map pages, the first and last year on the status change page'''
+    if page == 'Status change':
+        return (MI_YEARS[0], MI_YEARS[-1])
+    if page in COUNTY_VIEWS:
+        return BASE_YEAR
+    return None
+
+
+def _page_specs(page, charts):
+    specs = {}
+    for view, names in PAGE_VIEWS[page].items():
+        if not all(name in charts for name in names):
+            continue
+        chart = charts[names[0]]
+        for name in names[1:]:
+            chart = chart | charts[name]
+        with span('chart_spec', 'serialize'):
+            specs[view] = chart_spec(chart)
+    return specs
+
+
+def build_page_specs(page, whatif_rule=None, year=None):
+    '''Builds the Vega-Lite specs of every view of a page whose charts were built. Charts
+    whose datasets were evicted from geo_datasets since they were built are built again'''
+    try:
+        return _page_specs(page, build_page(page, DATA_KEY, whatif_rule, year))
+    except MissingDatasetError:
+        forget_page(page, DATA_KEY, whatif_rule, year)
+        return _page_specs(page, build_page(page, DATA_KEY, whatif_rule, year))
+
+
+def _county_specs(county_charts):
+    with span('chart_spec', 'serialize'):
+        return {page: chart_spec(county_charts['county_label'] | county_charts[name]) for page, name in COUNTY_VIEWS.items()}
+
+
+def build_county_specs(county_code, whatif_rule=None, year=BASE_YEAR):
+    '''Builds the Vega-Lite spec of one county's maps for every page that shows counties'''
+    try:
+        return _county_specs(memoized(build_county_maps, DATA_KEY, county_code, whatif_rule, year))
+    except MissingDatasetError:
+        forget(build_county_maps, DATA_KEY, county_code, whatif_rule, year)
+        return _county_specs(memoized(build_county_maps, DATA_KEY, county_code, whatif_rule, year))
+
+
+############## PRECOMPILED SPECS ##############
+#specs built ahead of time by `python group_project.py build`, for these inputs and this code
+#helper modules whose code shapes the specs, so editing one also retires the precompiled specs
+SPEC_MODULES = [os.path.join(ROOT_DIR, name + ".py") for name in ['geo_datasets', 'map_lod', 'server_transforms', 'rollup_cube',
+                                                                 'state_topology', 'atlas_years', 'lila_rules', 'tract_graph', 'tract_keys']]
+ARTIFACT_KEY = artifact_key(DATA_KEY + tuple(input_signature([__file__, TOPOLOGY_PATH, STATE_FIPS_PATH] + SPEC_MODULES)))
+
+
+def page_specs(page, whatif_rule=None, year=None):
+    '''Returns the specs of a page, precompiled when they were built for these inputs
+    and the page shows its default year without a what-if rule'''
+    specs = read_specs(ARTIFACT_KEY, page) if whatif_rule is None and year == default_year(page) else None
+    return specs if specs is not None else memoized(build_page_specs, DATA_KEY, page, whatif_rule, year)
+
+
+def county_specs(county_code, whatif_rule=None, year=BASE_YEAR):
+    '''Returns the specs of a county's maps, precompiled when they were built for these inputs'''
+    specs = read_specs(ARTIFACT_KEY, 'county_%05d' % county_code) if whatif_rule is None and year == BASE_YEAR else None
+    return specs if specs is not None else memoized(build_county_specs, DATA_KEY, county_code, whatif_rule, year)
+
+
+def county_names(whatif_rule=None):
+    '''Returns county name -> GEOID for the county picker'''
+    manifest = read_manifest(ARTIFACT_KEY) if whatif_rule is None else None
+    if manifest is not None:
+        return manifest['counties']
+    return memoized(build_county_index, DATA_KEY, whatif_rule).codes
+
+
+def build_artifacts():
+    '''Precompiles the specs of every page and every Michigan county into artifacts/'''
+    remove_stale(ARTIFACT_KEY)
+    total = 0
+    for page in PAGE_VIEWS:
+        total += write_specs(ARTIFACT_KEY, page, build_page_specs(page, None, default_year(page)))
+    counties = build_county_index().codes
+    for county_code in counties.values():
+        total += write_specs(ARTIFACT_KEY, 'county_%05d' % county_code, build_county_specs(county_code))
+    write_manifest(ARTIFACT_KEY, {'pages': list(PAGE_VIEWS), 'counties': counties, 'bytes': total})
+    print("precompiled %d pages and %d counties into artifacts/%s (%.1f MB)" % (len(PAGE_VIEWS), len(counties), ARTIFACT_KEY, total / 1e6))
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["build"]:
+    #usage: python group_project.py build -- precompiles every spec headlessly and exits
+    build_artifacts()
+    sys.exit()
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.TractSNAP:Q', title = 'Number on SNAP' ))
 
-interactive_washtenaw_SNAP_vis = washtenaw_SNAP_vis.encode(
-    tooltip=[alt.Tooltip('properties.TractSNAP:N', title='Number of Seniors'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+############## PAGE FEATURES ##############
+#adding page features
+st.markdown('<style>body{background-color: Black;color: White}</style>',unsafe_allow_html=True)
 
-washtenaw_seniors_vis = alt.Chart(washtenaw_data_geo).mark_geoshape(
+#Streamlit Code
 
-    stroke='white'
-).properties(
+selectbox1 = st.sidebar.selectbox(label='Select Topic', options=page_names())
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.TractSeniors:Q', title = 'Number of Seniors' ))
+#debug panel: when it is open, every load, transform, chart build and spec serialization of this rerun is timed
+stop_rerun()  #drops a recorder left behind by a rerun that raised
+if st.session_state.get('perf_debug', False):
+    st.session_state['perf_rerun'] = st.session_state.get('perf_rerun', 0) + 1
+    start_rerun(selectbox1, st.session_state['perf_rerun'], memory=st.session_state.get('perf_memory', False))
 
-interactive_washtenaw_seniors_vis = washtenaw_seniors_vis.encode(
-    tooltip=[alt.Tooltip('properties.TractSeniors:N', title='Number of Seniors'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+#atlas year: the map pages show one year, the status change page compares two
+year = default_year(selectbox1)
+if len(MI_YEARS) > 1 and selectbox1 in COUNTY_VIEWS:
+    year = st.sidebar.select_slider('Atlas year', options=MI_YEARS, value=BASE_YEAR)
+elif len(MI_YEARS) > 1 and selectbox1 == 'Status change':
+    year = st.sidebar.select_slider('Compare atlas years', options=MI_YEARS, value=(MI_YEARS[0], MI_YEARS[-1]))
 
-poverty_vis_washtenaw = alt.Chart(washtenaw_data_geo).mark_geoshape(
+#what-if sidebar: relabel every Michigan tract under a custom low income / low access definition
+whatif_rule = None
+if selectbox1 in ['Seniors', 'SNAP Benefits', 'Poverty']:
+    whatif = st.sidebar.expander('What-if food desert definition')
+    if whatif.checkbox('Use custom definition', value=False):
+        whatif_rule = LilaRule(
+            poverty_rate=whatif.slider('Poverty rate at least (%)', 0, 50, 20),
+            income_ratio=whatif.slider('Or income at most (share of state median)', 0.3, 1.0, 0.8),
+            urban_miles=whatif.select_slider('Urban distance (miles)', options=[0.5, 1, 10, 20], value=1),
+            rural_miles=whatif.select_slider('Rural distance (miles)', options=[0.5, 1, 10, 20], value=10),
+            vehicle=whatif.checkbox('Count low vehicle access', value=True))
 
-    stroke='white'
-).properties(
+#the selected page's inputs are loaded once per process, concurrently, unless precompiled specs cover this rerun
+startup_report = None
+if read_manifest(ARTIFACT_KEY) is None or whatif_rule is not None or year != default_year(selectbox1):
+    startup_report = memoized(preload_inputs, DATA_KEY, selectbox1)
 
-    width=500,
-    height=500
-).encode(
-    color= alt.Color('properties.PovertyRate:Q', title = 'Poverty Rate' )).encode(
-    tooltip=[alt.Tooltip('properties.PovertyRate:Q', title='Poverty Rate'),
-            alt.Tooltip('properties.CensusTract:N', title='Census Tract Number')])
+#pages with charts get their precompiled specs, the others (National map) their builders' output
+specs = page_specs(selectbox1, whatif_rule, year) if selectbox1 in PAGE_VIEWS else {}
+charts = build_page(selectbox1, DATA_KEY, whatif_rule) if selectbox1 not in PAGE_VIEWS else {}
 
+#county drill-down: any county of the loaded tracts, Wayne and Washtenaw by default
+picked_counties = []
+if selectbox1 in COUNTY_VIEWS:
+    county_codes = county_names(whatif_rule)
+    default_counties = [name for name in ['Wayne County', 'Washtenaw County'] if name in county_codes]
+    picked_counties = st.sidebar.multiselect('Counties', options=sorted(county_codes), default=default_counties)
 
+if whatif_rule is not None:
+    MI_censustract_df_merged_2019, _ = load_michigan_data(whatif_rule, year)
+    whatif.write('%d of %d tracts are food deserts' % (MI_censustract_df_merged_2019['food_desert_label'].sum(), len(MI_censustract_df_merged_2019)))
 
+#payload instrumentation: size of the Vega-Lite specs sent to the browser on this page
+show_payload = st.sidebar.checkbox('Show payload sizes', value=False)
+page_payload_bytes = []
 
-state_snap = interactive_state_snap + chart_points
-state_label = interactive_label_state + chart_points
-state_seniors = Seniors_vis + chart_points
-state_poverty = poverty_vis + chart_points
 
-wayne_snap = interactive_wayne_snap_vis + wayne_chart_points
-wayne_label = interactive_wayne_label_vis + wayne_chart_points
-wayne_seniors = interactive_wayne_seniors_vis + wayne_chart_points
-wayne_poverty = poverty_vis_wayne + wayne_chart_points
+def show_chart(spec, **kwargs):
+    '''Displays a Vega-Lite spec and, when payload sizes are shown, records its size'''
+    if show_payload:
+        page_payload_bytes.append(spec_bytes(spec))
+    st.vega_lite_chart(spec, **kwargs)
 
-washtenaw_snap = interactive_washtenaw_SNAP_vis + washtenaw_chart_points
-washtenaw_label = interactive_washtenawlabel_vis + washtenaw_chart_points
-washtenaw_seniors = interactive_washtenaw_seniors_vis + washtenaw_chart_points
-washtenaw_poverty = poverty_vis_washtenaw + washtenaw_chart_points
 
-#Streamlit Code
+def show_county_maps(page):
+    '''Shows the food desert label map next to the page's map for every picked county'''
+    for county in picked_counties:
+        st.subheader(county)
+        show_chart(county_specs(county_codes[county], whatif_rule, year)[page])
 
-selectbox1 = st.sidebar.selectbox(label='Select Topic', options=['Home', 'Seniors', 'SNAP Benefits', 'Poverty', '' 'Conclusion'])
 
 
 
@@ -463,7 +837,7 @@ if selectbox1 == 'Home':
     of food deserts for all areas within the UniteD States and on later pages refine information to the state of Michigan and specifically
     the counties of Wayne and Washtenaw.""")
 
-    st.altair_chart(regions_chart)
+    show_chart(specs['regions_chart'])
     st.caption('*Percentage of census tracts that qualify for food desert status by region*')
 
     st.header("Importance of Understanding Food Deserts")
@@ -490,12 +864,18 @@ if selectbox1 == 'Home':
     on to the 'shift' key and click the points."""
 
     #visuals
-    st.altair_chart(final_combined_visuals, use_container_width=True)
+    show_chart(specs['final_combined_visuals'], use_container_width=True)
 
     st.write("""*For drilled down views of Michigan, by census tract,
     select from the drop down to the left. There are several additional factors explored such as the distribution of
     SNAP Benefits compared with the areas of Michigan labeled as a Food Desert.*""")
 
+    if 'importance_chart' in specs:
+        st.header("Feature Importance")
+        st.write("""How much a random forest's ability to tell food deserts apart drops when each feature is shuffled,
+        averaged over cross-validation folds. Run "python feature_importance.py" to retrain on the current data.""")
+        show_chart(specs['importance_chart'])
+
 
 
 
@@ -519,9 +899,8 @@ more diverse food retailers.
 
 
 Use the following interactive maps to compare food desert labels and the number of seniors by census tract.""")
-    st.altair_chart(state_label | state_seniors )
-    st.altair_chart(wayne_label | wayne_seniors )
-    st.altair_chart(washtenaw_label | washtenaw_seniors)
+    show_chart(specs['state_seniors'])
+    show_county_maps('Seniors')
 
 elif selectbox1 == 'SNAP Benefits':
     st.title('Food Deserts and SNAP Benefits')
@@ -533,9 +912,8 @@ such as transportation serve as an impediment to residents of food deserts being
 from this program.""")
 
     st.write("""Use the following interactive maps to compare food desert labels and the number of people enrolled in SNAP benefits by census tract. """)
-    st.altair_chart(state_label | state_snap )
-    st.altair_chart(wayne_label | wayne_snap )
-    st.altair_chart(washtenaw_label | washtenaw_snap)
+    show_chart(specs['state_snap'])
+    show_county_maps('SNAP Benefits')
 
 
 elif selectbox1 == 'Poverty':
@@ -551,9 +929,48 @@ elif selectbox1 == 'Poverty':
 
     st.write("""Use the following interactive maps to compare food desert labels and Poverty Rate by census tract.""")
 
-    st.altair_chart(state_label | state_poverty )
-    st.altair_chart(wayne_label | wayne_poverty )
-    st.altair_chart(washtenaw_label | washtenaw_poverty)
+    show_chart(specs['state_poverty'])
+    show_county_maps('Poverty')
+
+elif selectbox1 == 'Status change':
+    st.title('Food Desert Status Over Time')
+
+    if 'status_map' not in specs:
+        st.write("""This page compares food desert labels across releases of the atlas. Add another year of it next to
+        MI_food_atlas2019.csv (MI_food_atlas2010.csv or MI_food_atlas2015.csv) to use it.""")
+    else:
+        st.write("""The USDA ERS atlas has been released for several years. The map below shows which Michigan census tracts
+        became food deserts, stopped being food deserts or kept the same label between the two years picked in the sidebar.""")
+
+        show_chart(specs['status_map'])
+
+elif selectbox1 == 'Hot spots':
+    st.title('Clusters of Food Deserts')
+
+    st.write("""Food deserts and the features behind them are not scattered at random. Global Moran's I measures how much
+    neighbouring census tracts (tracts sharing a border or a corner) resemble each other: 0 is no spatial pattern, values towards 1
+    are strong clustering.""")
+    show_chart(specs['morans_chart'])
+
+    st.write("""The Getis-Ord Gi* statistic finds where the clusters are. A hot spot is a tract whose neighbourhood has a
+    significantly higher value than the state as a whole, a cold spot a significantly lower one.""")
+    hot_spot_column = st.selectbox('Feature', options=CLUSTER_COLUMNS, format_func=lambda c: HOT_SPOT_TITLES[c])
+    show_chart(specs['hot_spots_' + hot_spot_column])
+
+elif selectbox1 == 'National map':
+    st.title('Food Deserts Across the United States')
+
+    if 'national_tiles' not in charts:
+        st.write("""The national map needs the national food atlas saved as food_atlas2019.csv next to group_project.py
+        and the tract store built with "python tract_store.py".""")
+    else:
+        st.write("""Every census tract in the country, drawn on the server as map tiles. Use the sliders to pan and zoom.""")
+        national_column = st.selectbox('Colour by', options=list(TILE_COLUMNS), format_func=lambda c: TILE_COLUMNS[c])
+        national_zoom = st.slider('Zoom', 3, 10, 4)
+        national_lon = st.slider('Longitude', -125.0, -66.0, -96.0)
+        national_lat = st.slider('Latitude', 24.0, 50.0, 39.0)
+        st.image(charts['national_tiles'].view(national_column, national_zoom, national_lon, national_lat),
+                 caption=TILE_COLUMNS[national_column])
 
 elif selectbox1 == 'Conclusion':
     st.title('Conclusion')
@@ -569,10 +986,50 @@ elif selectbox1 == 'Conclusion':
     st.write('Health and Socioeconomic Disparities of Food Deserts: https://sites.duke.edu/lit290s-1_02_s2017/2017/03/04/health-and-socioeconomic-disparities-of-food-deserts/')
 
 
-
-
-
-
+if show_payload:
+    print('%s page payload: %d charts, %.1f KB' % (selectbox1, len(page_payload_bytes), sum(page_payload_bytes) / 1024))
+    st.sidebar.caption('%s page payload: %d charts, %.1f KB' % (selectbox1, len(page_payload_bytes), sum(page_payload_bytes) / 1024))
+
+#the cache summary goes to the server log only after a rerun that rebuilt something; the debug panel always shows it
+rebuilt = cache_report(changes_only=True)
+if rebuilt:
+    print(rebuilt)
+
+#debug panel: spans of this rerun, and per page averages over every rerun of this session
+recorder = stop_rerun()
+run_context = get_script_run_ctx()
+if run_context is not None:
+    record_session(run_context.session_id, st.session_state)
+if st.sidebar.checkbox('Debug timings', value=False, key='perf_debug'):
+    st.sidebar.checkbox('Track peak memory (slower)', value=False, key='perf_memory')
+    perf_history = st.session_state.setdefault('perf_history', [])
+    if startup_report is not None:
+        st.sidebar.text(startup_report.format())
+    st.sidebar.text(cache_report())
+    if recorder is not None:
+        perf_history.extend(recorder.spans)
+        del perf_history[:-5000]
+        rerun_spans = pd.DataFrame(recorder.spans, columns=['name', 'kind', 'depth', 'seconds', 'peak_bytes'])
+        st.sidebar.write('Rerun %d of %s: %.0f ms in spans' % (recorder.rerun, recorder.page, 1000 * rerun_spans.loc[rerun_spans['depth'] == 0, 'seconds'].sum()))
+        if recorder.memory:
+            st.sidebar.caption('peak_MB is the traced peak of the whole server process during each span, other sessions included')
+        elif recorder.memory_skipped:
+            st.sidebar.caption('Peak memory not tracked: another session was tracking it during this rerun')
+        st.sidebar.dataframe(rerun_spans.assign(ms=(rerun_spans['seconds'] * 1000).round(1), peak_MB=(rerun_spans['peak_bytes'] / 1e6).round(2),
+                                                name=['. ' * d + n for d, n in zip(rerun_spans['depth'], rerun_spans['name'])])[['name', 'kind', 'ms', 'peak_MB']])
+    if perf_history:
+        history = pd.DataFrame(perf_history)
+        st.sidebar.write('Per page, over this session')
+        st.sidebar.dataframe(history.groupby(['page', 'name'])['seconds'].agg(['count', 'mean', 'max']).mul([1, 1000, 1000]).round(1))
+        st.sidebar.download_button('Export spans (JSON lines)', to_jsonl(perf_history), file_name='spans.jsonl', mime='application/json')
+
+    #memory: datasets and built charts are held once per process, sessions only add their session state
+    shared = shared_report(shared_frames())
+    sessions = session_sizes()
+    st.sidebar.write('Shared datasets: %.1f MB for every session' % (shared['bytes'].sum() / 1e6))
+    st.sidebar.dataframe(shared.assign(MB=(shared['bytes'] / 1e6).round(2))[['dataset', 'MB']])
+    if sessions:
+        st.sidebar.write('%d active sessions, %.2f MB per additional session' % (len(sessions), sum(sessions.values()) / len(sessions) / 1e6))
 
 
 
@@ -0,0 +1,147 @@
+import itertools
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+#the four USDA ERS flags that make up the default food desert label
+LILA_FLAGS = ['LILATracts_1And10', 'LILATracts_halfAnd10', 'LILATracts_1And20', 'LILATracts_Vehicle']
+
+#distances (in miles) the atlas reports low access population counts for
+ACCESS_DISTANCES = {0.5: 'lapophalf', 1: 'lapop1', 10: 'lapop10', 20: 'lapop20'}
+
+#columns the rule engine reads from the food atlas
+RULE_COLUMNS = ['State', 'Urban', 'Pop2010', 'PovertyRate', 'MedianFamilyIncome', 'LATractsVehicle_20'] + list(ACCESS_DISTANCES.values())
+
+#one low income / low access definition, with the USDA 1 and 10 mile measure as defaults
+LilaRule = namedtuple('LilaRule', ['poverty_rate', 'income_ratio', 'urban_miles', 'rural_miles', 'min_pop', 'min_share', 'vehicle'])
+LilaRule.__new__.__defaults__ = (20.0, 0.8, 1, 10, 500, 0.33, False)
+
+
+def food_desert_label(row):
+    '''This function lables a tract as a food desert if it falls under 1 of 4
+    measures as determined by the USDA ERS Atlas'''
+    if row['LILATracts_1And10'] == 1:
+        return 1
+    if row['LILATracts_halfAnd10'] == 1:
+        return 1
+    if row['LILATracts_1And20'] == 1:
+        return 1
+    if row['LILATracts_Vehicle'] == 1:
+        return 1
+    else:
+        return 0
+
+
+def food_desert_labels(atlas, flags=LILA_FLAGS):
+    '''Labels every tract as a food desert (1) if any of the given flags is 1,
+    the columnar equivalent of applying food_desert_label to each row'''
+    return (atlas[flags].to_numpy() == 1).any(axis=1).astype(np.int64)
+
+
+class RuleInputs(object):
+    '''Holds the atlas columns used by the rules as plain NumPy arrays so that
+    evaluating a rule is a handful of array comparisons'''
+
+    def __init__(self, atlas):
+        self.urban = atlas['Urban'].to_numpy() == 1
+        self.poverty_rate = atlas['PovertyRate'].to_numpy(dtype=np.float64)
+
+        #ratio of tract median family income to the state median
+        income = atlas['MedianFamilyIncome'].to_numpy(dtype=np.float64)
+        state_median = atlas.groupby('State')['MedianFamilyIncome'].transform('median').to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.income_ratio = income / state_median
+
+        #low access population and share, one column per distance
+        self.distances = sorted(ACCESS_DISTANCES)
+        pop = atlas['Pop2010'].to_numpy(dtype=np.float64)
+        self.access_pop = np.column_stack([atlas[ACCESS_DISTANCES[d]].fillna(0).to_numpy(dtype=np.float64) for d in self.distances])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.access_share = np.where(pop[:, None] > 0, self.access_pop / pop[:, None], 0.0)
+
+        self.vehicle = atlas['LATractsVehicle_20'].to_numpy() == 1
+
+    def distance_index(self, miles):
+        '''Returns the column index of a distance, which must be one the atlas reports'''
+        try:
+            return self.distances.index(miles)
+        except ValueError:
+            raise ValueError('no low access data at %s miles, choose one of %s' % (miles, self.distances))
+
+
+def evaluate_rule(inputs, rule):
+    '''Returns a boolean array marking the tracts that are food deserts under rule'''
+    return evaluate_scenarios(inputs, [rule])[:, 0]
+
+
+def evaluate_scenarios(inputs, rules):
+    '''Evaluates many rules in one pass and returns a (tracts x rules) boolean matrix'''
+    if not isinstance(inputs, RuleInputs):
+        inputs = RuleInputs(inputs)
+    rules = list(rules)
+
+    poverty = np.array([r.poverty_rate for r in rules], dtype=np.float64)
+    ratio = np.array([r.income_ratio for r in rules], dtype=np.float64)
+    low_income = (inputs.poverty_rate[:, None] >= poverty) | (inputs.income_ratio[:, None] <= ratio)
+
+    #each tract uses the urban or rural distance of the rule, picked by fancy indexing
+    urban_idx = np.array([inputs.distance_index(r.urban_miles) for r in rules])
+    rural_idx = np.array([inputs.distance_index(r.rural_miles) for r in rules])
+    distance_idx = np.where(inputs.urban[:, None], urban_idx, rural_idx)
+    rows = np.arange(len(inputs.urban))[:, None]
+    access_pop = inputs.access_pop[rows, distance_idx]
+    access_share = inputs.access_share[rows, distance_idx]
+
+    min_pop = np.array([r.min_pop for r in rules], dtype=np.float64)
+    min_share = np.array([r.min_share for r in rules], dtype=np.float64)
+    low_access = (access_pop >= min_pop) | (access_share >= min_share)
+
+    vehicle = np.array([r.vehicle for r in rules], dtype=bool)
+    low_access |= inputs.vehicle[:, None] & vehicle
+
+    return low_income & low_access
+
+
+def scenario_grid(poverty_rates=(20.0,), income_ratios=(0.8,), urban_miles=(1,), rural_miles=(10,), vehicle=(False,)):
+    '''Builds every combination of the given thresholds as a list of rules'''
+    return [LilaRule(poverty_rate=p, income_ratio=i, urban_miles=u, rural_miles=r, vehicle=v)
+            for p, i, u, r, v in itertools.product(poverty_rates, income_ratios, urban_miles, rural_miles, vehicle)]
+
+
+def benchmark(atlas, repeat=5):
+    '''Times the row-wise apply label against the columnar label and a grid of scenarios'''
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        atlas.apply(lambda row: food_desert_label(row), axis=1)
+    results['apply'] = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        food_desert_labels(atlas)
+    results['vectorized'] = (time.perf_counter() - start) / repeat
+
+    inputs = RuleInputs(atlas)
+    rules = scenario_grid(poverty_rates=[10, 15, 20, 25, 30], income_ratios=[0.6, 0.7, 0.8, 0.9],
+                          urban_miles=[0.5, 1], rural_miles=[10, 20])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        evaluate_scenarios(inputs, rules)
+    results['scenarios'] = (time.perf_counter() - start) / repeat
+    results['scenario_count'] = len(rules)
+    return results
+
+
+if __name__ == '__main__':
+    #usage: python lila_rules.py [path to food atlas csv]
+    path = sys.argv[1] if len(sys.argv) > 1 else 'MI_food_atlas2019.csv'
+    atlas = pd.read_csv(path, usecols=lambda c: c in LILA_FLAGS or c in RULE_COLUMNS)
+    results = benchmark(atlas)
+    print('%d tracts' % len(atlas))
+    print('apply:      %.2f ms' % (results['apply'] * 1000))
+    print('vectorized: %.2f ms' % (results['vectorized'] * 1000))
+    print('%d scenarios: %.2f ms' % (results['scenario_count'], results['scenarios'] * 1000))
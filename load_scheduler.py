@@ -0,0 +1,90 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+#one input to load: function() is started as soon as every task named in deps has finished
+LoadTask = namedtuple('LoadTask', ['name', 'function', 'deps'])
+LoadTask.__new__.__defaults__ = ((),)
+
+
+def _timed_call(function):
+    start = time.perf_counter()
+    result = function()
+    return result, start, time.perf_counter()
+
+
+def run_loads(tasks, workers=None, processes=False):
+    '''Runs the tasks concurrently, each one as soon as its dependencies are done, and returns
+    (results by name, LoadReport). Threads suit the CSV, shapefile and parquet readers,
+    which spend most of their time outside the GIL; processes=True is for pure python
+    parsing, and needs picklable functions and results'''
+    tasks = list(tasks)
+    names = {task.name for task in tasks}
+    for task in tasks:
+        unknown = set(task.deps) - names
+        if unknown:
+            raise ValueError('%s depends on unknown tasks %s' % (task.name, sorted(unknown)))
+
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    #threads also overlap waiting on disk, so like the standard pool they outnumber the cores
+    workers = workers or max(min(len(tasks), (os.cpu_count() or 1) + (0 if processes else 4)), 1)
+    results, timings, running = {}, {}, {}
+    pending = list(tasks)
+    started = time.perf_counter()
+    with pool_class(max_workers=workers) as pool:
+        while pending or running:
+            for task in [t for t in pending if all(d in results for d in t.deps)]:
+                running[pool.submit(_timed_call, task.function)] = task.name
+                pending.remove(task)
+            if not running:
+                raise ValueError('circular dependencies between %s' % sorted(t.name for t in pending))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], start, end = future.result()
+                timings[name] = (start - started, end - started)
+    return results, LoadReport(tasks, timings, time.perf_counter() - started)
+
+
+class LoadReport(object):
+    '''Start and end of every task of a run, and the chain of tasks that set its length'''
+
+    def __init__(self, tasks, timings, wall):
+        self.deps = {task.name: list(task.deps) for task in tasks}
+        self.timings = timings
+        self.wall = wall
+
+    def critical_path(self):
+        '''Walks back from the task that finished last through the dependency that
+        finished last each time; speeding up anything off this path cannot help'''
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while self.deps[name]:
+            name = max(self.deps[name], key=lambda n: self.timings[n][1])
+            path.append(name)
+        return path[::-1]
+
+    def busy(self):
+        '''Sum of every task's own time, what loading one after another would take'''
+        return sum(end - start for start, end in self.timings.values())
+
+    def format(self):
+        lines = ['startup: %.0f ms wall, %.0f ms of loading (%.1fx overlap)' % (
+            self.wall * 1000, self.busy() * 1000, self.busy() / self.wall if self.wall else 1)]
+        lines.append('critical path:')
+        previous_end = 0.0
+        for name in self.critical_path():
+            start, end = self.timings[name]
+            lines.append('  %-32s %7.0f ms  (starts at %.0f ms, waited %.0f ms)' % (
+                name, (end - start) * 1000, start * 1000, (start - previous_end) * 1000))
+            previous_end = end
+        off_path = sorted(set(self.timings) - set(self.critical_path()), key=lambda n: self.timings[n][0])
+        if off_path:
+            lines.append('in parallel:')
+            for name in off_path:
+                start, end = self.timings[name]
+                lines.append('  %-32s %7.0f ms  (%.0f-%.0f ms)' % (name, (end - start) * 1000, start * 1000, end * 1000))
+        return '\n'.join(lines)
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import psutil
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from benchmark_suite import git_commit
+
+ROOT_DIR = os.path.dirname(__file__)
+APP_PATH = os.path.join(ROOT_DIR, "group_project.py")
+RESULTS_DIR = os.path.join(ROOT_DIR, "load_results")
+
+#page switch patterns every simulated session repeats; sessions start at different offsets
+PATTERNS = {'maps': ['Seniors', 'SNAP Benefits', 'Poverty'],
+            'tour': ['Home', 'Seniors', 'SNAP Benefits', 'Poverty', 'Status change', 'Hot spots', 'Conclusion']}
+PAGE_SELECTBOX = 'Select Topic'
+PERCENTILES = [50, 95, 99]
+SAMPLE_SECONDS = 0.25
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, app_path=APP_PATH, timeout=120):
+    '''Starts the app with streamlit run on localhost and waits until it answers its health check'''
+    server = subprocess.Popen([sys.executable, "-m", "streamlit", "run", app_path, "--server.headless=true",
+                               "--server.port=%d" % port, "--server.address=127.0.0.1", "--server.fileWatcherType=none",
+                               "--server.enableXsrfProtection=false", "--server.enableCORS=false",
+                               "--browser.gatherUsageStats=false"],
+                              cwd=os.path.dirname(os.path.abspath(app_path)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%d/_stcore/health" % port, timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("streamlit did not start on port %d" % port)
+
+
+def _rerun_message(page_script_hash, selectbox_id=None, page=None):
+    message = BackMsg()
+    message.rerun_script.page_script_hash = page_script_hash
+    if selectbox_id is not None:
+        widget = message.rerun_script.widget_states.widgets.add()
+        widget.id = selectbox_id
+        widget.string_value = page
+    return message.SerializeToString()
+
+
+class Session(object):
+    '''One browser tab: a websocket to the app that sends reruns and waits for them to finish'''
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.page_script_hash = ''
+        self.selectbox_id = None
+
+    async def rerun(self, page=None):
+        '''Runs the script (switching to page when given) and returns (seconds, bytes received, errors)'''
+        start = time.perf_counter()
+        await self.websocket.send(_rerun_message(self.page_script_hash, self.selectbox_id, page))
+        received, errors = 0, 0
+        while True:
+            raw = await self.websocket.recv()
+            received += len(raw)
+            message = ForwardMsg()
+            message.ParseFromString(raw)
+            kind = message.WhichOneof('type')
+            if kind == 'new_session':
+                self.page_script_hash = message.new_session.main_script_hash
+            elif kind == 'delta' and message.delta.WhichOneof('type') == 'new_element':
+                element = message.delta.new_element
+                if element.WhichOneof('type') == 'exception':
+                    errors += 1
+                elif element.WhichOneof('type') == 'selectbox' and element.selectbox.label == PAGE_SELECTBOX:
+                    self.selectbox_id = element.selectbox.id
+            elif kind == 'script_finished':
+                #a rerun request can first finish the run it interrupts; only a finished run counts
+                if message.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    return time.perf_counter() - start, received, errors
+                if message.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    return time.perf_counter() - start, received, errors + 1
+
+
+async def run_session(url, index, pages, rounds, think, results):
+    '''Opens the app, then walks through the pages rounds times, starting at its own offset'''
+    async with websockets.connect(url, subprotocols=['streamlit'], max_size=None) as websocket:
+        session = Session(websocket)
+        seconds, received, errors = await session.rerun()
+        results.append({'session': index, 'page': '(first load)', 'seconds': seconds, 'bytes': received, 'errors': errors})
+        for step in range(rounds * len(pages)):
+            page = pages[(index + step) % len(pages)]
+            await asyncio.sleep(think)
+            seconds, received, errors = await session.rerun(page)
+            results.append({'session': index, 'page': page, 'seconds': seconds, 'bytes': received, 'errors': errors})
+
+
+def monitor(pid, samples, stop):
+    '''Samples the server's CPU use and resident memory until stop is set'''
+    process = psutil.Process(pid)
+    process.cpu_percent()
+    while not stop.wait(SAMPLE_SECONDS):
+        samples.append((process.cpu_percent(), process.memory_info().rss))
+
+
+def load_test(sessions=50, pattern='maps', rounds=3, think=0.0, app_path=APP_PATH, warm=True):
+    '''Starts the app, runs sessions concurrent simulated users and returns (reruns, server samples, wall seconds).
+    With warm, one session first walks the pattern once untimed, so the timed run measures a server
+    whose caches are loaded rather than every session arriving at a cold start'''
+    port = free_port()
+    server = start_server(port, app_path)
+    samples, stop = [], threading.Event()
+    watcher = threading.Thread(target=monitor, args=(server.pid, samples, stop), daemon=True)
+    results = []
+    try:
+        url = "ws://127.0.0.1:%d/_stcore/stream" % port
+        pages = PATTERNS[pattern]
+        if warm:
+            asyncio.run(run_session(url, 0, pages, 1, 0.0, []))
+        watcher.start()
+
+        async def run_all():
+            await asyncio.gather(*[run_session(url, i, pages, rounds, think, results) for i in range(sessions)])
+        start = time.perf_counter()
+        asyncio.run(run_all())
+        wall = time.perf_counter() - start
+    finally:
+        stop.set()
+        if watcher.is_alive():
+            watcher.join()
+        server.terminate()
+        server.wait()
+    return pd.DataFrame(results), pd.DataFrame(samples, columns=['cpu_percent', 'rss']), wall
+
+
+def summarize(reruns, samples, wall):
+    '''Latency percentiles and payload per page, and the server's CPU and memory'''
+    pages = {}
+    for page, rows in list(reruns.groupby('page', sort=False)) + [('(all)', reruns)]:
+        latency = np.percentile(rows['seconds'] * 1000, PERCENTILES)
+        pages[page] = dict({'p%d_ms' % p: float(v) for p, v in zip(PERCENTILES, latency)},
+                           reruns=int(len(rows)), errors=int(rows['errors'].sum()), mean_kb=float(rows['bytes'].mean() / 1024))
+    return {'pages': pages, 'wall_seconds': wall, 'reruns_per_second': len(reruns) / wall if wall else 0.0,
+            'cpu_percent_mean': float(samples['cpu_percent'].mean()) if len(samples) else None,
+            'cpu_percent_max': float(samples['cpu_percent'].max()) if len(samples) else None,
+            'rss_mb_max': float(samples['rss'].max() / 1e6) if len(samples) else None}
+
+
+def print_summary(summary):
+    print("%-16s %7s %9s %9s %9s %9s %7s" % ('page', 'reruns', 'p50 ms', 'p95 ms', 'p99 ms', 'mean KB', 'errors'))
+    for page, row in summary['pages'].items():
+        print("%-16s %7d %9.0f %9.0f %9.0f %9.1f %7d" % (page, row['reruns'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['mean_kb'], row['errors']))
+    print("%.1f reruns/s over %.1fs; server CPU %.0f%% mean, %.0f%% max; RSS %.0f MB max" % (
+        summary['reruns_per_second'], summary['wall_seconds'], summary['cpu_percent_mean'] or 0, summary['cpu_percent_max'] or 0, summary['rss_mb_max'] or 0))
+
+
+def run(sessions=50, pattern='maps', rounds=3, think=0.0, start='warm'):
+    '''Runs a load test on a warmed (start='warm') or cold server and writes its summary to
+    load_results/<commit>-<pattern>-<sessions>[-cold].json'''
+    reruns, samples, wall = load_test(sessions, pattern, rounds, think, warm=start == 'warm')
+    summary = summarize(reruns, samples, wall)
+    summary.update({'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                    'cpus': os.cpu_count(), 'sessions': sessions, 'pattern': pattern, 'rounds': rounds, 'think': think, 'start': start})
+    print("%s server" % start)
+    print_summary(summary)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "%s-%s-%d%s.json" % (summary['commit'] or time.strftime('%Y%m%d-%H%M%S'), pattern, sessions,
+                                                          '' if start == 'warm' else '-' + start))
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=1)
+    print("results written to %s" % path)
+    return path
+
+
+def compare(old_path, new_path, threshold=0.1):
+    '''Prints each page's p95 latency and payload between two result files, flagging increases
+    over threshold; returns the number flagged, so a script can fail on it'''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("%s -> %s (%s, %d sessions)" % (old['commit'], new['commit'], new['pattern'], new['sessions']))
+    if (old['pattern'], old['sessions'], old['rounds'], old.get('start')) != (new['pattern'], new['sessions'], new['rounds'], new.get('start')):
+        print("  note: the runs used different patterns, session counts, rounds or server starts")
+    flagged = 0
+    for page, after in new['pages'].items():
+        before = old['pages'].get(page)
+        if before is None:
+            continue
+        for field, unit in [('p95_ms', 'ms'), ('mean_kb', 'KB')]:
+            change = after[field] / before[field] - 1 if before[field] else 0
+            flag = "  REGRESSION" if change > threshold else ""
+            flagged += bool(flag)
+            print("  %-16s %-8s %9.1f %s -> %9.1f %s (%+.0f%%)%s" % (page, field, before[field], unit, after[field], unit, change * 100, flag))
+    return flagged
+
+
+if __name__ == "__main__":
+    #usage: python load_test.py [sessions] [maps|tour] [rounds] [think seconds] [warm|cold|both]
+    #                                                     -- 50 sessions on the maps pattern against a warmed server by default
+    #       python load_test.py compare old.json new.json -- exits 1 when a page got over 10% slower or heavier
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        sys.exit(1 if compare(sys.argv[2], sys.argv[3]) else 0)
+    args = sys.argv[1:]
+    starts = {'warm': ['warm'], 'cold': ['cold'], 'both': ['cold', 'warm']}[args[4] if len(args) > 4 else 'warm']
+    for start in starts:
+        run(int(args[0]) if args else 50, args[1] if len(args) > 1 else 'maps',
+            int(args[2]) if len(args) > 2 else 3, float(args[3]) if len(args) > 3 else 0.0, start)
@@ -0,0 +1,81 @@
+import sys
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+#simplification tolerances in degrees, from full resolution to coarse
+LOD_TOLERANCES = [0.0, 0.0002, 0.0005, 0.001, 0.002, 0.005]
+
+
+def simplify_level(geometry, tolerance):
+    '''Simplifies a GeoSeries while keeping the boundaries shared by neighbouring
+    tracts identical, so no gaps or slivers open up between them'''
+    if tolerance == 0:
+        return geometry
+    try:
+        simplified = shapely.coverage_simplify(geometry.values, tolerance)
+    except shapely.errors.UnsupportedGEOSVersionError:
+        #shapely built on GEOS older than 3.12: each polygon stays valid but shared edges can drift apart slightly
+        simplified = shapely.simplify(geometry.values, tolerance, preserve_topology=True)
+    return gpd.GeoSeries(simplified, index=geometry.index, crs=geometry.crs)
+
+
+def build_pyramid(frame, tolerances=LOD_TOLERANCES):
+    '''Returns a dict of tolerance -> simplified geometry for the frame's geometry column.
+    Only geometry is stored so attributes can change without rebuilding the pyramid'''
+    geometry = frame.geometry
+    return {tolerance: simplify_level(geometry, tolerance) for tolerance in tolerances}
+
+
+def pick_tolerance(bounds, width, height, tolerances=LOD_TOLERANCES):
+    '''Picks the coarsest tolerance that stays under half a pixel for a map of
+    width x height pixels covering bounds (minx, miny, maxx, maxy)'''
+    minx, miny, maxx, maxy = bounds
+    half_pixel = 0.5 * min((maxx - minx) / width, (maxy - miny) / height)
+    usable = [t for t in tolerances if t <= half_pixel]
+    return max(usable) if usable else min(tolerances)
+
+
+def with_level(frame, pyramid, tolerance):
+    '''Returns frame with its geometry swapped for the given pyramid level'''
+    return frame.set_geometry(pyramid[tolerance].loc[frame.index].values)
+
+
+def level_for_chart(frame, pyramid, width=500, height=500):
+    '''Returns frame at the coarsest level that looks the same on a width x height chart'''
+    tolerance = pick_tolerance(frame.total_bounds, width, height, sorted(pyramid))
+    return with_level(frame, pyramid, tolerance)
+
+
+def lod_report(pyramid, index=None):
+    '''Returns vertex counts and GeoJSON size per level, optionally for a subset of rows'''
+    rows = []
+    for tolerance, geometry in sorted(pyramid.items()):
+        if index is not None:
+            geometry = geometry.loc[index]
+        rows.append({
+            "tolerance": tolerance,
+            "vertices": int(shapely.get_num_coordinates(geometry.values).sum()),
+            "geojson_bytes": len(geometry.to_json().encode("utf-8")),
+        })
+    report = pd.DataFrame(rows)
+    report["bytes_vs_full"] = report["geojson_bytes"] / report["geojson_bytes"].iloc[0]
+    return report
+
+
+if __name__ == "__main__":
+    #usage: python map_lod.py [STATEFP] -- prints the byte/vertex report for the state and its Wayne and Washtenaw views
+    from tract_store import load_state_tracts
+
+    statefp = int(sys.argv[1]) if len(sys.argv) > 1 else 26
+    tracts = load_state_tracts([statefp])
+    pyramid = build_pyramid(tracts)
+
+    print("State %02d, 500x500 chart uses tolerance %s" % (statefp, pick_tolerance(tracts.total_bounds, 500, 500)))
+    print(lod_report(pyramid).to_string(index=False))
+    for name, county in [("Wayne", 26163), ("Washtenaw", 26161)]:
+        rows = tracts[tracts["GEOID"] // 1000000 == county]
+        if len(rows):
+            print("\n%s County, 500x500 chart uses tolerance %s" % (name, pick_tolerance(rows.total_bounds, 500, 500)))
+            print(lod_report(pyramid, rows.index).to_string(index=False))
@@ -0,0 +1,70 @@
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+#sessions seen within this many seconds count as active
+SESSION_TIMEOUT = 600
+
+#session id -> (last rerun time, bytes held in its session state)
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _values_bytes(values):
+    '''Bytes of a column or series, without its index'''
+    if values.dtype.name == 'geometry':
+        return 16 * int(shapely.get_num_coordinates(np.asarray(values.values)).sum()) + 8 * len(values)
+    return int(values.memory_usage(deep=True, index=False))
+
+
+def deep_bytes(value, seen=None):
+    '''Estimates the memory a value holds, counting every object reachable from it once.
+    Geometries count 16 bytes per coordinate, frames and series their deep memory usage'''
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return sum(_values_bytes(value[column]) for column in value.columns) + int(value.index.memory_usage(deep=True))
+    if isinstance(value, pd.Series):
+        return _values_bytes(value) + int(value.index.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        return sum(deep_bytes(getattr(value, part), seen) for part in ['data', 'indices', 'indptr', 'row', 'col'] if hasattr(value, part))
+    if isinstance(value, (dict, MappingProxyType)):
+        return sys.getsizeof(value) + sum(deep_bytes(k, seen) + deep_bytes(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(deep_bytes(v, seen) for v in value)
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return sys.getsizeof(value) + deep_bytes(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+def record_session(session_id, session_state):
+    '''Notes how much the session state of a session holds, once per rerun'''
+    size = deep_bytes({key: session_state[key] for key in list(session_state.keys())})
+    with _lock:
+        _sessions[session_id] = (time.time(), size)
+
+
+def session_sizes():
+    '''Returns the session state bytes of every active session, dropping those gone quiet'''
+    now = time.time()
+    with _lock:
+        for session_id in [s for s, (seen, _) in _sessions.items() if now - seen > SESSION_TIMEOUT]:
+            del _sessions[session_id]
+        return {session_id: size for session_id, (_, size) in _sessions.items()}
+
+
+def shared_report(shared):
+    '''Returns a frame of the bytes every shared dataset holds, largest first'''
+    seen = set()
+    sizes = [(name, deep_bytes(value, seen)) for name, value in shared.items()]
+    return pd.DataFrame(sizes, columns=['dataset', 'bytes']).sort_values('bytes', ascending=False, ignore_index=True)
@@ -0,0 +1,230 @@
+import hashlib
+import io
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from shapely.geometry import box
+
+from data_cache import input_signature
+from lila_rules import food_desert_labels
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from tract_store import available_states, load_state_tracts, store_files
+
+ROOT_DIR = os.path.dirname(__file__)
+NATIONAL_FOOD_ATLAS_PATH = os.path.join(ROOT_DIR, "food_atlas2019.csv")
+TILE_DIR = os.path.join(ROOT_DIR, "tiles")
+
+#web mercator tiles, the same layout as web map tiles
+TILE_SIZE = 256
+ORIGIN = 20037508.342789244
+
+#columns that can be mapped and their legend titles
+TILE_COLUMNS = {'food_desert_label': 'Food Desert Label', 'TractSNAP': 'Number on SNAP',
+                'TractSeniors': 'Number of Seniors', 'PovertyRate': 'Poverty Rate'}
+LABEL_COLORS = ListedColormap(['#4c78a8', '#f58518'])
+
+
+def national_inputs(food_atlas_path=NATIONAL_FOOD_ATLAS_PATH):
+    '''Returns the files the national map is built from'''
+    return store_files(available_states()) + [food_atlas_path]
+
+
+def data_key(food_atlas_path=NATIONAL_FOOD_ATLAS_PATH):
+    '''Hashes the national inputs; tiles live in a folder named after it, so any change
+    to the inputs starts a fresh pyramid'''
+    return hashlib.sha1(repr(input_signature(national_inputs(food_atlas_path))).encode("utf-8")).hexdigest()[:12]
+
+
+def source_path(key):
+    return os.path.join(TILE_DIR, key, "tracts.parquet")
+
+
+def prepare_source(food_atlas_path=NATIONAL_FOOD_ATLAS_PATH):
+    '''Merges every stored state's tracts with the national food atlas, projects them to
+    web mercator and writes them where the tile renderers read them. Returns the data key'''
+    key = data_key(food_atlas_path)
+    path = source_path(key)
+    if os.path.exists(path):
+        return key
+    if not available_states():
+        raise ValueError("the national map reads the tract store, run tract_store.py first")
+
+    #tiles of older inputs are stale, remove them
+    if os.path.isdir(TILE_DIR):
+        for old in os.listdir(TILE_DIR):
+            shutil.rmtree(os.path.join(TILE_DIR, old))
+
+    tracts = load_state_tracts(available_states())
+    atlas = read_atlas(food_atlas_path, FOOD_ATLAS_COLUMNS)
+    atlas['food_desert_label'] = food_desert_labels(atlas)
+    merged = tracts.merge(atlas, left_on='GEOID', right_on='CensusTract', how='inner')
+    merged = merged[['geometry', 'CensusTract'] + list(TILE_COLUMNS)].to_crs(epsg=3857)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    merged.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return key
+
+
+def tile_bounds(z, x, y):
+    '''Returns the web mercator bounds (minx, miny, maxx, maxy) of a tile'''
+    size = 2 * ORIGIN / 2 ** z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def lonlat_to_tile(lon, lat, z):
+    '''Returns the (x, y) of the tile containing a lon/lat at zoom z'''
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_covering(frame, z):
+    '''Lists the tiles of zoom z that contain at least one tract'''
+    n = 2 ** z
+    size = 2 * ORIGIN / n
+    minx, miny, maxx, maxy = frame.total_bounds
+    tiles = []
+    for x in range(max(int((minx + ORIGIN) // size), 0), min(int((maxx + ORIGIN) // size), n - 1) + 1):
+        for y in range(max(int((ORIGIN - maxy) // size), 0), min(int((ORIGIN - miny) // size), n - 1) + 1):
+            if len(frame.sindex.query(box(*tile_bounds(z, x, y)))):
+                tiles.append((z, x, y))
+    return tiles
+
+
+def color_range(frame, column):
+    '''Returns the vmin/vmax every tile of a column shares, so neighbouring tiles match'''
+    if column == 'food_desert_label':
+        return 0, 1
+    values = frame[column].dropna().to_numpy()
+    return float(np.percentile(values, 2)), float(np.percentile(values, 98))
+
+
+def render_tile(frame, column, z, x, y, vmin, vmax):
+    '''Draws one 256x256 tile of a column and returns it as PNG bytes'''
+    bounds = tile_bounds(z, x, y)
+    fig = Figure(figsize=(1, 1), dpi=TILE_SIZE)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    subset = frame.iloc[frame.sindex.query(box(*bounds))]
+    if len(subset):
+        cmap = LABEL_COLORS if column == 'food_desert_label' else 'viridis'
+        subset.plot(ax=ax, column=column, cmap=cmap, vmin=vmin, vmax=vmax, linewidth=0.1 if z >= 8 else 0, edgecolor='white')
+    ax.set_xlim(bounds[0], bounds[2])
+    ax.set_ylim(bounds[1], bounds[3])
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', transparent=True)
+    return buffer.getvalue()
+
+
+def tile_path(key, column, z, x, y):
+    return os.path.join(TILE_DIR, key, column, str(z), str(x), "%d.png" % y)
+
+
+def _write_tile(path, png):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    #a temporary file of its own, so a reader never opens a tile another writer is halfway through
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+
+
+#one lock per tile path, so sessions asking for the same missing tile render it once
+_tile_locks = {}
+_tile_locks_lock = threading.Lock()
+
+
+def _tile_lock(path):
+    with _tile_locks_lock:
+        return _tile_locks.setdefault(path, threading.Lock())
+
+
+#each worker process reads the source frame once and renders many tiles from it
+_worker_frame = None
+
+
+def _init_worker(path):
+    global _worker_frame
+    _worker_frame = gpd.read_parquet(path)
+
+
+def _render_to_disk(args):
+    key, column, z, x, y, vmin, vmax = args
+    _write_tile(tile_path(key, column, z, x, y), render_tile(_worker_frame, column, z, x, y, vmin, vmax))
+    return z
+
+
+def build_pyramid(columns=TILE_COLUMNS, zooms=range(3, 8), workers=None, food_atlas_path=NATIONAL_FOOD_ATLAS_PATH):
+    '''Renders every missing tile of the given columns and zooms across a process pool.
+    Returns the data key and the number of tiles rendered'''
+    key = prepare_source(food_atlas_path)
+    frame = gpd.read_parquet(source_path(key))
+    jobs = []
+    for column in columns:
+        vmin, vmax = color_range(frame, column)
+        for z in zooms:
+            for _, x, y in tiles_covering(frame, z):
+                if not os.path.exists(tile_path(key, column, z, x, y)):
+                    jobs.append((key, column, z, x, y, vmin, vmax))
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source_path(key),)) as pool:
+            list(pool.map(_render_to_disk, jobs, chunksize=16))
+    return key, len(jobs)
+
+
+class NationalTiles(object):
+    '''Serves tiles from the pyramid, rendering (and caching) any that are missing'''
+
+    def __init__(self, food_atlas_path=NATIONAL_FOOD_ATLAS_PATH):
+        self.key = prepare_source(food_atlas_path)
+        self.frame = gpd.read_parquet(source_path(self.key))
+        self.ranges = {column: color_range(self.frame, column) for column in TILE_COLUMNS}
+
+    def tile(self, column, z, x, y):
+        '''Returns one tile as an RGBA array'''
+        path = tile_path(self.key, column, z, x, y)
+        if not os.path.exists(path):
+            with _tile_lock(path):
+                if not os.path.exists(path):
+                    vmin, vmax = self.ranges[column]
+                    _write_tile(path, render_tile(self.frame, column, z, x, y, vmin, vmax))
+        return plt.imread(path)
+
+    def view(self, column, z, lon, lat, size=3):
+        '''Returns a size x size mosaic of tiles centred on lon/lat as one RGBA array'''
+        cx, cy = lonlat_to_tile(lon, lat, z)
+        n = 2 ** z
+        rows = []
+        for y in range(cy - size // 2, cy - size // 2 + size):
+            row = []
+            for x in range(cx - size // 2, cx - size // 2 + size):
+                if 0 <= y < n:
+                    row.append(self.tile(column, z, x % n, y))
+                else:
+                    row.append(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.float32))
+            rows.append(np.concatenate(row, axis=1))
+        return np.concatenate(rows, axis=0)
+
+
+if __name__ == "__main__":
+    #usage: python national_tiles.py [max zoom] -- builds the tile pyramid from zoom 3 up to max zoom
+    max_zoom = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    start = time.perf_counter()
+    key, count = build_pyramid(zooms=range(3, max_zoom + 1))
+    print("rendered %d tiles into %s in %.1fs" % (count, os.path.join(TILE_DIR, key), time.perf_counter() - start))
@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+
+from perf_spans import span
+
+#page name -> list of builders, each returning a dict of named charts
+page_registry = OrderedDict()
+#page name -> names of the startup loads its builders read
+_page_loads = {}
+
+#built results, kept in this imported module so they survive streamlit reruns
+_built = OrderedDict()
+MAX_BUILT = 32
+
+#every session of the server shares _built: one lock guards its lookups, inserts and evictions,
+#and a lock per key being built makes other sessions wait for that build rather than repeat it
+_built_lock = threading.Lock()
+_building = {}
+
+
+def register_page(name, builders=(), loads=()):
+    '''Declares a sidebar page, the lazy builders its charts come from and the startup
+    loads (see load_scheduler.py) those builders read'''
+    page_registry[name] = list(builders)
+    _page_loads[name] = list(loads)
+
+
+def page_loads(name):
+    '''Returns the names of the startup loads a page needs'''
+    return _page_loads.get(name, [])
+
+
+def page_names():
+    '''Returns the registered pages in the order they were declared'''
+    return list(page_registry)
+
+
+def memoized(builder, key, *args):
+    '''Returns builder(*args), building it only the first time it is asked for with
+    this key and arguments. The oldest results are dropped past MAX_BUILT entries'''
+    memo_key = (builder.__name__, key) + args
+    with _built_lock:
+        if memo_key in _built:
+            _built.move_to_end(memo_key)
+            return _built[memo_key]
+        building = _building.setdefault(memo_key, threading.Lock())
+    with building:
+        with _built_lock:
+            if memo_key in _built:
+                _built.move_to_end(memo_key)
+                return _built[memo_key]
+        try:
+            with span(builder.__name__, 'chart build'):
+                result = builder(*args)
+            with _built_lock:
+                _built[memo_key] = result
+                while len(_built) > MAX_BUILT:
+                    _built.popitem(last=False)
+        finally:
+            #stored before the key stops counting as being built, so no session can miss both
+            with _built_lock:
+                _building.pop(memo_key, None)
+    return result
+
+
+def forget(builder, key, *args):
+    '''Drops a built result, so the next request builds it again'''
+    with _built_lock:
+        _built.pop((builder.__name__, key) + args, None)
+
+
+def forget_page(name, key, *args):
+    '''Drops the built results of every builder of a page'''
+    for builder in page_registry[name]:
+        forget(builder, key, *args)
+
+
+def build_page(name, key, *args):
+    '''Runs (or reuses) only the builders of the selected page and returns their
+    charts merged into one dict'''
+    charts = {}
+    for builder in page_registry[name]:
+        charts.update(memoized(builder, key, *args))
+    return charts
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+import tracemalloc
+import weakref
+
+#each streamlit session runs its script in its own thread, so the recorder is per thread
+_local = threading.local()
+
+#tracemalloc's peak is process wide, so only one recorder at a time tracks memory: a second
+#session resetting the peak would corrupt the first one's numbers. Held weakly, so a session
+#that went away mid rerun does not keep the tracking to itself
+_memory_owner = None
+_memory_lock = threading.Lock()
+
+
+class _NoSpan(object):
+    '''What span returns when nothing is recording: entering and leaving it does nothing'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Recorder(object):
+    '''Collects the spans of one rerun of one page'''
+
+    def __init__(self, page, rerun, memory=False):
+        self.page = page
+        self.rerun = rerun
+        self.memory = memory
+        #memory was asked for but another session was tracking it
+        self.memory_skipped = False
+        self.started = time.perf_counter()
+        self.spans = []
+        self.stack = []
+
+    def fold_peak(self):
+        '''Folds the traced memory peak since the last fold into every open span'''
+        if not self.memory:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        for open_span in self.stack:
+            open_span.peak = max(open_span.peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+
+class _Span(object):
+
+    def __init__(self, recorder, name, kind):
+        self.recorder = recorder
+        self.name = name
+        self.kind = kind
+        self.peak = 0
+        self.start_memory = 0
+
+    def __enter__(self):
+        recorder = self.recorder
+        if recorder.memory:
+            self.start_memory = recorder.fold_peak()
+            self.peak = self.start_memory
+        recorder.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        recorder = self.recorder
+        recorder.fold_peak()
+        recorder.stack.pop()
+        recorder.spans.append({'page': recorder.page, 'rerun': recorder.rerun, 'name': self.name, 'kind': self.kind,
+                               'depth': len(recorder.stack), 'start': self.start - recorder.started, 'seconds': seconds,
+                               'peak_bytes': self.peak - self.start_memory if recorder.memory else None})
+        return False
+
+
+def span(name, kind='transform'):
+    '''Times the block it wraps (and its peak traced memory when enabled) in the current
+    rerun. Returns a shared do-nothing span when no rerun is being recorded'''
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        return NO_SPAN
+    return _Span(recorder, name, kind)
+
+
+def start_rerun(page, rerun=0, memory=False):
+    '''Starts recording spans for this thread's rerun. memory=True also tracks peak
+    memory with tracemalloc, which slows every allocation while it runs; it is skipped
+    (memory_skipped) while another session's rerun is tracking memory. The peak still
+    counts what other sessions allocate meanwhile, it is a process wide figure'''
+    global _memory_owner
+    recorder = Recorder(page, rerun, memory)
+    _local.recorder = recorder
+    if memory:
+        with _memory_lock:
+            if _memory_owner is None or _memory_owner() is None:
+                _memory_owner = weakref.ref(recorder)
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+            else:
+                recorder.memory = False
+                recorder.memory_skipped = True
+    return recorder
+
+
+def stop_rerun():
+    '''Stops recording and returns the rerun's recorder, or None when nothing was recording'''
+    global _memory_owner
+    recorder = getattr(_local, 'recorder', None)
+    _local.recorder = None
+    if recorder is not None and recorder.memory:
+        with _memory_lock:
+            if _memory_owner is not None and _memory_owner() is recorder:
+                _memory_owner = None
+                tracemalloc.stop()
+    return recorder
+
+
+def to_jsonl(spans):
+    '''Returns spans as JSON lines, one span per line'''
+    return ''.join(json.dumps(record) + '\n' for record in spans)
+
+
+def export_jsonl(spans, path):
+    '''Appends spans as JSON lines to path'''
+    with open(path, 'a') as f:
+        f.write(to_jsonl(spans))
@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+
+import pandas as pd
+
+from atlas_schema import CENSUS_DATA_COLUMNS, read_atlas
+from data_cache import input_signature
+
+ROOT_DIR = os.path.dirname(__file__)
+CUBE_DIR = os.path.join(ROOT_DIR, "rollup_cube")
+CUBE_PATH = os.path.join(CUBE_DIR, "cube.parquet")
+BASE_PATH = os.path.join(CUBE_DIR, "base.parquet")
+SOURCE_PATH = os.path.join(CUBE_DIR, "source.json")
+
+#how each column of ERSAtlas_CensusData.csv is rolled up, matching the state_level aggregation
+SUM_COLUMNS = ["TotalPop", "Hispanic", "Asian", "White", "Black", "Native", "Pacific"]
+MEAN_COLUMNS = ["Walk", "ChildPoverty", "Service", "Construction"]
+MEDIAN_COLUMNS = ["MedianIncome"]
+
+#group keys of each level, every level is also split by food_desert_label
+LEVELS = {"region": ["region"], "state": ["region", "State"], "county": ["region", "State", "County"]}
+KEY_COLUMNS = ["region", "State", "County"]
+
+#key columns of each level in the rolled up output
+OUTPUT_KEYS = {"region": ["region"], "state": ["State", "region"], "county": ["State", "region", "County"]}
+
+
+def _partials(rows, keys):
+    '''Sums and counts of rows per group; these add up, so new rows can be folded in'''
+    groups = rows.groupby(keys + ["food_desert_label"], observed=True)
+    partials = groups.size().rename("n").to_frame()
+    for column in SUM_COLUMNS + MEAN_COLUMNS:
+        partials[column + "_sum"] = groups[column].sum()
+    for column in MEAN_COLUMNS:
+        partials[column + "_count"] = groups[column].count()
+    return partials
+
+
+def _medians(rows, keys):
+    groups = rows.groupby(keys + ["food_desert_label"], observed=True)
+    return pd.DataFrame({column + "_median": groups[column].median() for column in MEDIAN_COLUMNS})
+
+
+def _level_frame(level, keys, partials, medians):
+    frame = partials.join(medians).reset_index()
+    frame.insert(0, "level", level)
+    return frame
+
+
+def _prepare(rows):
+    '''Keeps the rollup columns of tract rows, with text keys so groups line up across appends'''
+    rows = rows[[c for c in CENSUS_DATA_COLUMNS if c in rows.columns]].copy()
+    if "County" not in rows:
+        rows["County"] = ""
+    for column in KEY_COLUMNS:
+        rows[column] = rows[column].astype(str)
+    return rows
+
+
+#sessions of one server that find the cube stale build it once, the others wait for it
+_cube_lock = threading.Lock()
+
+
+def _temp_path():
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=CUBE_DIR)
+    os.close(fd)
+    return tmp_path
+
+
+def _write(cube, base, source):
+    os.makedirs(CUBE_DIR, exist_ok=True)
+    #each file through a temporary file of its own, the source last so it only vouches for a written cube
+    for frame, path in [(base, BASE_PATH), (cube, CUBE_PATH)]:
+        tmp_path = _temp_path()
+        frame.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    tmp_path = _temp_path()
+    with open(tmp_path, "w") as f:
+        json.dump(source, f)
+    os.replace(tmp_path, SOURCE_PATH)
+
+
+def build_cube(csv_path):
+    '''Builds the cube from scratch out of ERSAtlas_CensusData.csv'''
+    base = _prepare(read_atlas(csv_path, CENSUS_DATA_COLUMNS))
+    cube = pd.concat([_level_frame(level, keys, _partials(base, keys), _medians(base, keys))
+                      for level, keys in LEVELS.items()], ignore_index=True)
+    _write(cube, base, {"csv": input_signature([csv_path])})
+    return cube
+
+
+def append_tracts(rows):
+    '''Folds new tract rows into an existing cube. Sums and counts are added to the stored
+    ones, medians are recomputed only for the groups the new rows fall in'''
+    rows = _prepare(rows)
+    base = pd.concat([pd.read_parquet(BASE_PATH), rows], ignore_index=True)
+    cube = pd.read_parquet(CUBE_PATH)
+    with open(SOURCE_PATH) as f:
+        source = json.load(f)
+
+    levels = []
+    for level, keys in LEVELS.items():
+        group_keys = keys + ["food_desert_label"]
+        old = cube[cube["level"] == level].set_index(group_keys)
+        partial_columns = [c for c in old.columns if c == "n" or c.endswith("_sum") or c.endswith("_count")]
+        partials = pd.concat([old[partial_columns], _partials(rows, keys)]).groupby(level=group_keys).sum()
+
+        #only the groups touched by the new rows need their medians recomputed
+        touched = rows[group_keys].drop_duplicates()
+        touched_medians = _medians(base.merge(touched, on=group_keys), keys)
+        medians = old[[c for c in old.columns if c.endswith("_median")]]
+        medians = pd.concat([medians.drop(touched_medians.index, errors="ignore"), touched_medians])
+        levels.append(_level_frame(level, keys, partials, medians))
+
+    cube = pd.concat(levels, ignore_index=True)
+    source["appended"] = source.get("appended", 0) + len(rows)
+    _write(cube, base, source)
+    return cube
+
+
+def load_cube(csv_path):
+    '''Returns the cube, rebuilding it when ERSAtlas_CensusData.csv has changed since it was built'''
+    with _cube_lock:
+        if os.path.exists(CUBE_PATH) and os.path.exists(SOURCE_PATH):
+            with open(SOURCE_PATH) as f:
+                source = json.load(f)
+            if source["csv"] == [list(s) for s in input_signature([csv_path])]:
+                return pd.read_parquet(CUBE_PATH)
+        return build_cube(csv_path)
+
+
+def rollup(cube, level):
+    '''Turns one level of the cube into the state_level layout the charts use: one row per
+    group and food desert label, with FoodDesert_Totals, medians, means and sums'''
+    rows = cube[cube["level"] == level]
+    frame = rows[OUTPUT_KEYS[level] + ["food_desert_label"]].copy()
+    frame["FoodDesert_Totals"] = rows["n"] * rows["food_desert_label"]
+    for column in MEDIAN_COLUMNS:
+        frame[column] = rows[column + "_median"]
+    for column in MEAN_COLUMNS:
+        frame[column] = rows[column + "_sum"] / rows[column + "_count"]
+    for column in SUM_COLUMNS:
+        frame[column] = rows[column + "_sum"]
+    #same column order as the original groupby aggregation
+    frame = frame[OUTPUT_KEYS[level] + ["food_desert_label", "FoodDesert_Totals", "MedianIncome", "Walk", "TotalPop", "ChildPoverty",
+                                        "Service", "Construction", "Hispanic", "Asian", "White", "Black", "Native", "Pacific"]]
+    frame = frame.sort_values(OUTPUT_KEYS[level] + ["food_desert_label"]).reset_index(drop=True)
+    return frame.rename(columns={"region": "Region"})
+
+
+def load_state_level(csv_path):
+    '''Returns the state level frame (State, Region, food_desert_label, aggregates) from the cube'''
+    return rollup(load_cube(csv_path), "state")
+
+
+if __name__ == "__main__":
+    #usage: python rollup_cube.py build [ERSAtlas_CensusData.csv]
+    #       python rollup_cube.py append new_tracts.csv
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if command == "append":
+        cube = append_tracts(pd.read_csv(sys.argv[2]))
+    else:
+        cube = build_cube(sys.argv[2] if len(sys.argv) > 2 else os.path.join(ROOT_DIR, "ERSAtlas_CensusData.csv"))
+    print(cube.groupby("level").size().to_string())
+    print("%s: %.1f KB" % (CUBE_PATH, os.path.getsize(CUBE_PATH) / 1024))
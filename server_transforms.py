@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+
+def sum_rows(frame, columns, by):
+    '''Server side pre-aggregation for a stacked bar: sums the columns over the by groups, so
+    the browser gets one row per group however fine grained (county, tract) the input is.
+    The columns are left wide; folded rows would repeat the group keys and the column name
+    for every value, more bytes than the fold saves the browser'''
+    return frame.groupby(by, observed=True, sort=False)[columns].sum().reset_index()
+
+
+def regression_lines(frame, x, y, by):
+    '''Server side transform_regression (linear, over the x extent of each group): returns
+    the two end points of every group's least squares line. The fit only needs five sums
+    per group, so its cost is one pass over the rows'''
+    rows = frame[[by, x, y]].dropna()
+    xs, ys = rows[x].to_numpy(dtype=np.float64), rows[y].to_numpy(dtype=np.float64)
+    sums = pd.DataFrame({by: rows[by].to_numpy(), 'n': 1.0, 'sx': xs, 'sy': ys, 'sxx': xs * xs, 'sxy': xs * ys,
+                         'lo': xs, 'hi': xs}).groupby(by, observed=True)
+    fit = sums[['n', 'sx', 'sy', 'sxx', 'sxy']].sum().join(sums['lo'].min()).join(sums['hi'].max())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (fit['n'] * fit['sxy'] - fit['sx'] * fit['sy']) / (fit['n'] * fit['sxx'] - fit['sx'] ** 2)
+    #a group with a single x value has no slope, its line is flat at the mean
+    slope = slope.fillna(0.0)
+    intercept = (fit['sy'] - slope * fit['sx']) / fit['n']
+    ends = pd.concat([fit['lo'], fit['hi']]).sort_index(kind='stable')
+    return pd.DataFrame({by: ends.index, x: ends.to_numpy(), y: (intercept.reindex(ends.index) + slope.reindex(ends.index) * ends).to_numpy()})
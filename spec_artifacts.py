@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import shutil
+
+ROOT_DIR = os.path.dirname(__file__)
+ARTIFACT_DIR = os.path.join(ROOT_DIR, "artifacts")
+
+#specs read from disk, kept in this imported module so every rerun and session shares them
+_loaded = {}
+
+
+def artifact_key(data_key):
+    '''Names the artifact folder after a hash of the input signatures the specs were built from'''
+    return hashlib.sha1(repr(data_key).encode("utf-8")).hexdigest()[:12]
+
+
+def spec_path(key, group):
+    return os.path.join(ARTIFACT_DIR, key, group.replace(" ", "_") + ".json")
+
+
+def write_specs(key, group, specs):
+    '''Writes a group of Vega-Lite specs (name -> spec) to one file. Datasets several specs
+    share are stored once, with each spec keeping only the names it references'''
+    datasets, stripped = {}, {}
+    for name, spec in specs.items():
+        spec = dict(spec)
+        spec_datasets = spec.pop("datasets", {})
+        datasets.update(spec_datasets)
+        stripped[name] = {"spec": spec, "datasets": sorted(spec_datasets)}
+    path = spec_path(key, group)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"datasets": datasets, "specs": stripped}, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    return os.path.getsize(path)
+
+
+def read_specs(key, group):
+    '''Returns the precompiled specs of a group with their datasets attached again,
+    or None when the group was not built for these inputs'''
+    path = spec_path(key, group)
+    if path not in _loaded:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            stored = json.load(f)
+        specs = {}
+        for name, entry in stored["specs"].items():
+            specs[name] = dict(entry["spec"], datasets={d: stored["datasets"][d] for d in entry["datasets"]})
+        _loaded[path] = specs
+    return _loaded[path]
+
+
+def remove_stale(key):
+    '''Removes the artifacts of every other set of inputs'''
+    if os.path.isdir(ARTIFACT_DIR):
+        for old in os.listdir(ARTIFACT_DIR):
+            if old != key:
+                shutil.rmtree(os.path.join(ARTIFACT_DIR, old))
+
+
+
+def write_manifest(key, manifest):
+    '''Writes what the build produced; it is written last, so its presence means the build finished'''
+    path = os.path.join(ARTIFACT_DIR, key, "manifest.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def read_manifest(key):
+    '''Returns the manifest of a finished build for these inputs, or None'''
+    path = os.path.join(ARTIFACT_DIR, key, "manifest.json")
+    if path not in _loaded:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            _loaded[path] = json.load(f)
+    return _loaded[path]
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from map_lod import simplify_level
+from tract_store import available_states, load_state_tracts
+
+ROOT_DIR = os.path.dirname(__file__)
+STATE_FIPS_PATH = os.path.join(ROOT_DIR, "state_fips.csv")
+TOPOLOGY_PATH = os.path.join(ROOT_DIR, "states.topo.json")
+#what the mini map draws when states.topo.json has not been built: the us-atlas states the app used before
+US_ATLAS_URL = "https://cdn.jsdelivr.net/npm/vega-datasets@v1.29.0/data/us-10m.json"
+
+#coordinates are snapped to a QUANTIZATION x QUANTIZATION grid over the country's bounds
+QUANTIZATION = 100000
+#about 1 km, well under a pixel on the 250px mini map
+STATE_TOLERANCE = 0.01
+
+#loaded once per process, every rerun and session shares them
+_state_fips = None
+_topology = None
+
+
+def state_fips():
+    '''Returns the State -> FIPS id table the mini map joins on'''
+    global _state_fips
+    if _state_fips is None:
+        _state_fips = pd.read_csv(STATE_FIPS_PATH)
+    return _state_fips.copy()
+
+
+def dissolve_states(tracts, tolerance=STATE_TOLERANCE):
+    '''Merges tract polygons into one simplified outline per state, with the
+    borders neighbouring states share kept identical'''
+    states = tracts[['STATEFP', tracts.geometry.name]].dissolve(by='STATEFP')
+    simplified = simplify_level(states.geometry, tolerance)
+    #d3 draws lon/lat polygons with clockwise exterior rings, anything else covers the globe
+    states = states.set_geometry(gpd.GeoSeries(shapely.orient_polygons(simplified.values, exterior_cw=True), index=states.index, crs=states.crs))
+    return states[~states.geometry.is_empty]
+
+
+def _rings(geometry):
+    '''Yields (part, ring) for every exterior and interior ring of a (Multi)Polygon'''
+    for part, polygon in enumerate(getattr(geometry, 'geoms', [geometry])):
+        yield part, polygon.exterior
+        for interior in polygon.interiors:
+            yield part, interior
+
+
+def _quantize(ring, translate, scale):
+    '''Snaps a ring to the grid and drops repeated points; returns it without the closing point'''
+    points = np.round((np.asarray(ring.coords) - translate) / scale).astype(np.int64)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (np.diff(points, axis=0) != 0).any(axis=1)
+    points = [tuple(p) for p in points[keep].tolist()]
+    return points[:-1] if len(points) > 1 and points[0] == points[-1] else points
+
+
+def encode_topology(geometries, ids, name='states', quantization=QUANTIZATION):
+    '''Encodes (Multi)Polygons as a quantized TopoJSON topology. Borders shared by two
+    geometries are stored once as an arc both reference, and arcs are delta encoded'''
+    minx, miny, maxx, maxy = shapely.total_bounds(np.asarray(geometries))
+    translate = np.array([minx, miny])
+    scale = np.array([(maxx - minx) / (quantization - 1), (maxy - miny) / (quantization - 1)])
+
+    rings = []
+    for index, geometry in enumerate(geometries):
+        for part, ring in _rings(geometry):
+            points = _quantize(ring, translate, scale)
+            if len(points) >= 3:
+                rings.append((index, part, points))
+
+    #a junction is a point whose neighbours differ between the rings passing through it,
+    #where a shared border starts or ends
+    neighbours = {}
+    for _, _, points in rings:
+        for i, point in enumerate(points):
+            pair = frozenset([points[i - 1], points[(i + 1) % len(points)]])
+            neighbours.setdefault(point, set()).add(pair)
+    junctions = {point for point, pairs in neighbours.items() if len(pairs) > 1}
+
+    arcs, arc_index = [], {}
+
+    def arc_id(points):
+        key = tuple(points)
+        if key in arc_index:
+            return arc_index[key]
+        if key[::-1] in arc_index:
+            return ~arc_index[key[::-1]]
+        arc_index[key] = len(arcs)
+        arcs.append(points)
+        return arc_index[key]
+
+    shapes = [{} for _ in geometries]
+    for index, part, points in rings:
+        cuts = [i for i, point in enumerate(points) if point in junctions]
+        if not cuts:
+            #a ring with no junctions is one closed arc, started at its smallest point
+            start = points.index(min(points))
+            ring_arcs = [arc_id(points[start:] + points[:start + 1])]
+        else:
+            points = points[cuts[0]:] + points[:cuts[0]]
+            cuts = [i - cuts[0] for i in cuts] + [len(points)]
+            points = points + points[:1]
+            ring_arcs = [arc_id(points[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])]
+        shapes[index].setdefault(part, []).append(ring_arcs)
+
+    objects = []
+    for geometry_id, parts in zip(ids, shapes):
+        polygons = [parts[part] for part in sorted(parts)]
+        if len(polygons) == 1:
+            objects.append({'type': 'Polygon', 'id': geometry_id, 'arcs': polygons[0]})
+        elif polygons:
+            objects.append({'type': 'MultiPolygon', 'id': geometry_id, 'arcs': polygons})
+
+    encoded = []
+    for points in arcs:
+        points = np.array(points, dtype=np.int64)
+        encoded.append(np.vstack([points[:1], np.diff(points, axis=0)]).tolist())
+    return {'type': 'Topology', 'transform': {'scale': scale.tolist(), 'translate': translate.tolist()},
+            'objects': {name: {'type': 'GeometryCollection', 'geometries': objects}}, 'arcs': encoded}
+
+
+def build_topology(path=TOPOLOGY_PATH):
+    '''Builds the states topology out of every state in the tract store and writes it to path'''
+    if not available_states():
+        raise ValueError("the states topology is built from the tract store, run tract_store.py first")
+    states = dissolve_states(load_state_tracts(available_states()))
+    topology = encode_topology(list(states.geometry), [int(s) for s in states.index])
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(topology, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return topology
+
+
+def load_topology(path=TOPOLOGY_PATH):
+    '''Returns the bundled states topology, or None when states.topo.json has not been
+    built (python state_topology.py); the app never builds it inside a rerun'''
+    global _topology
+    if _topology is None and os.path.exists(path):
+        with open(path) as f:
+            _topology = json.load(f)
+    return _topology
+
+
+if __name__ == "__main__":
+    #usage: python state_topology.py -- rebuilds states.topo.json from the tract store
+    topology = build_topology()
+    geometries = topology['objects']['states']['geometries']
+    print("%s: %d states, %d arcs, %.1f KB" % (TOPOLOGY_PATH, len(geometries), len(topology['arcs']), os.path.getsize(TOPOLOGY_PATH) / 1024))
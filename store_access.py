@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from data_cache import cached_frame
+from lila_rules import LilaRule, RuleInputs, evaluate_rule
+from tract_lookup import TractIndex
+from tract_store import available_states, load_state_tracts, store_files
+
+ROOT_DIR = os.path.dirname(__file__)
+
+#distances are measured in CONUS Albers, an equal area projection in meters
+PROJECTED_CRS = 'EPSG:5070'
+METERS_PER_MILE = 1609.344
+
+#spacing of the population grid; the USDA atlas also measures from 0.5 km grid cells
+GRID_METERS = 500
+
+
+class PopulationPoints(object):
+    '''Points standing in for where the people of each tract live: a regular grid over the
+    tracts, each tract's Pop2010 spread evenly over its grid points. Tracts too small to
+    hold a grid point get their representative point instead'''
+
+    def __init__(self, tracts, spacing=GRID_METERS):
+        geometry = np.asarray(tracts.geometry.to_crs(PROJECTED_CRS).values)
+        minx, miny, maxx, maxy = shapely.total_bounds(geometry)
+        index = TractIndex(gpd.GeoDataFrame(geometry=geometry), columns=[])
+        xs = np.arange(minx + spacing / 2, maxx, spacing)
+
+        #one grid row at a time keeps the candidate pairs of the tree query small
+        x, y, tract = [], [], []
+        for row_y in np.arange(miny + spacing / 2, maxy, spacing):
+            rows = index.tract_rows(xs, np.full(len(xs), row_y))
+            inside = rows >= 0
+            x.append(xs[inside])
+            y.append(np.full(inside.sum(), row_y))
+            tract.append(rows[inside])
+        counts = np.bincount(np.concatenate(tract), minlength=len(geometry)) if tract else np.zeros(len(geometry), dtype=np.int64)
+        missing = np.flatnonzero(counts == 0)
+        centers = shapely.point_on_surface(geometry[missing])
+        x.append(shapely.get_x(centers))
+        y.append(shapely.get_y(centers))
+        tract.append(missing)
+
+        self.x = np.concatenate(x)
+        self.y = np.concatenate(y)
+        self.tract = np.concatenate(tract).astype(np.int32)
+        self.tract_count = len(geometry)
+        population = tracts['Pop2010'].to_numpy(dtype=np.float64)
+        self.weight = population[self.tract] / np.bincount(self.tract, minlength=self.tract_count)[self.tract]
+
+    def __len__(self):
+        return len(self.x)
+
+
+def project_stores(stores):
+    '''Projects a frame of store lon/lat columns to PROJECTED_CRS meters'''
+    transformer = Transformer.from_crs('EPSG:4326', PROJECTED_CRS, always_xy=True)
+    x, y = transformer.transform(stores['lon'].to_numpy(dtype=np.float64), stores['lat'].to_numpy(dtype=np.float64))
+    return np.column_stack([x, y])
+
+
+def nearest_store_miles(points, stores):
+    '''Returns the distance in miles from every population point to its nearest store'''
+    tree = cKDTree(project_stores(stores))
+    distance, _ = tree.query(np.column_stack([points.x, points.y]), k=1, workers=-1)
+    return distance / METERS_PER_MILE
+
+
+def low_access_population(points, miles, distances):
+    '''Returns the (tracts x distances) population living farther than each distance from a store'''
+    return np.column_stack([np.bincount(points.tract, weights=points.weight * (miles > d), minlength=points.tract_count)
+                            for d in distances])
+
+
+def access_inputs(atlas, access_pop, distances):
+    '''RuleInputs for the atlas with its low access counts replaced by recomputed ones,
+    so rules can use any of the given distances'''
+    inputs = RuleInputs(atlas)
+    pop = atlas['Pop2010'].to_numpy(dtype=np.float64)
+    inputs.distances = list(distances)
+    inputs.access_pop = access_pop
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inputs.access_share = np.where(pop[:, None] > 0, access_pop / pop[:, None], 0.0)
+    return inputs
+
+
+def recompute_labels(points, atlas, stores, rule=LilaRule()):
+    '''Re-derives food_desert_label from a store list: nearest store distances, low access
+    population at the rule's urban and rural distances, then the rule itself'''
+    distances = sorted({rule.urban_miles, rule.rural_miles})
+    access_pop = low_access_population(points, nearest_store_miles(points, stores), distances)
+    return evaluate_rule(access_inputs(atlas, access_pop, distances), rule).astype(np.int64)
+
+
+def merged_atlas(statefps, atlas_path):
+    '''Stored tracts of the given states merged with the atlas, in tract order'''
+    tracts = load_state_tracts(statefps)
+    atlas = read_atlas(atlas_path, FOOD_ATLAS_COLUMNS)
+    return tracts.merge(atlas, left_on='GEOID', right_on='CensusTract', how='inner').reset_index(drop=True)
+
+
+def load_access_data(statefps, atlas_path):
+    '''Returns (merged atlas, population points), cached on disk until the tracts or atlas
+    change; only the stores then vary between runs'''
+    name = 'store_access_' + '_'.join('%02d' % s for s in sorted(statefps))
+    def build():
+        merged = merged_atlas(statefps, atlas_path)
+        return pd.DataFrame(merged.drop(columns='geometry')), PopulationPoints(merged)
+    return cached_frame(name, store_files(statefps) + [atlas_path], build)
+
+
+if __name__ == '__main__':
+    #usage: python store_access.py urban_miles rural_miles stores.csv [changed_stores.csv ...]
+    #store csvs need lon and lat columns; every stored state is used with MI_food_atlas2019.csv.
+    #with several store lists the tracts whose label changed from the first are listed
+    if len(sys.argv) < 4:
+        sys.exit('usage: python store_access.py urban_miles rural_miles stores.csv [changed_stores.csv ...]')
+    rule = LilaRule(urban_miles=float(sys.argv[1]), rural_miles=float(sys.argv[2]))
+    atlas, points = load_access_data(available_states() or [26], os.path.join(ROOT_DIR, 'MI_food_atlas2019.csv'))
+    print('%d tracts, %d population points' % (len(atlas), len(points)))
+    first = None
+    for path in sys.argv[3:]:
+        stores = pd.read_csv(path)
+        start = time.perf_counter()
+        labels = recompute_labels(points, atlas, stores, rule)
+        print('%s: %d stores, %d food deserts (%.2fs)' % (path, len(stores), labels.sum(), time.perf_counter() - start))
+        if first is None:
+            first = labels
+        else:
+            changed = atlas.loc[labels != first, ['CensusTract', 'County']].assign(food_desert_label=labels[labels != first])
+            print(changed.to_string(index=False) if len(changed) else 'no tract changed')
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+from scipy.stats import norm
+
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from data_cache import cached_frame
+from lila_rules import food_desert_labels
+from tract_store import available_states, load_state_tracts, store_files
+
+ROOT_DIR = os.path.dirname(__file__)
+
+#columns the hot spot page and the command line test for clustering
+CLUSTER_COLUMNS = ['food_desert_label', 'TractSNAP', 'TractSeniors', 'PovertyRate']
+
+#Gi* z score bins, from the strongest hot spot down to the strongest cold spot
+HOT_SPOT_BINS = [(2.576, 'Hot spot (99%)'), (1.960, 'Hot spot (95%)'), (1.645, 'Hot spot (90%)')]
+COLD_SPOT_BINS = [(-2.576, 'Cold spot (99%)'), (-1.960, 'Cold spot (95%)'), (-1.645, 'Cold spot (90%)')]
+NOT_SIGNIFICANT = 'Not significant'
+NO_DATA = 'No data'
+HOT_SPOT_CLASSES = [name for _, name in HOT_SPOT_BINS] + [NOT_SIGNIFICANT] + [name for _, name in COLD_SPOT_BINS[::-1]] + [NO_DATA]
+
+
+def contiguity_graph(geometry, kind='queen'):
+    '''Returns the binary, symmetric (tracts x tracts) CSR adjacency matrix of the polygons.
+    Queen neighbours share at least a point; rook neighbours share a stretch of border,
+    checked for every queen pair at once on the intersection of their boundaries'''
+    geometry = np.asarray(geometry)
+    left, right = shapely.STRtree(geometry).query(geometry, predicate='intersects')
+    keep = left < right
+    left, right = left[keep], right[keep]
+    if kind == 'rook':
+        boundary = shapely.boundary(geometry)
+        shared = shapely.length(shapely.intersection(boundary[left], boundary[right])) > 0
+        left, right = left[shared], right[shared]
+    elif kind != 'queen':
+        raise ValueError('unknown contiguity %s, use queen or rook' % kind)
+    n = len(geometry)
+    upper = sparse.csr_matrix((np.ones(len(left), dtype=np.float64), (left, right)), shape=(n, n))
+    return (upper + upper.T).tocsr()
+
+
+def _valid(weights, x):
+    '''Drops the tracts without a value, from the values and both sides of the graph'''
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    if valid.all():
+        return weights, x, valid
+    return weights[valid][:, valid], x[valid], valid
+
+
+def morans_i(weights, x):
+    '''Global Moran's I of x on row standardised weights, with its z score and two sided
+    p value under the normality assumption. Tracts without neighbours add nothing'''
+    weights, x, _ = _valid(weights, x)
+    n = len(x)
+    neighbours = np.asarray(weights.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        w = sparse.diags(np.where(neighbours > 0, 1 / neighbours, 0)) @ weights
+    z = x - x.mean()
+    s0 = w.sum()
+    s1 = 0.5 * (w + w.T).power(2).sum()
+    s2 = ((np.asarray(w.sum(axis=1)).ravel() + np.asarray(w.sum(axis=0)).ravel()) ** 2).sum()
+    expected = -1 / (n - 1)
+    #a graph without links or a constant x leaves I undefined (NaN)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        i = n / s0 * (z @ (w @ z)) / (z @ z)
+        variance = (n * n * s1 - n * s2 + 3 * s0 * s0) / ((n * n - 1) * s0 * s0) - expected ** 2
+        z_score = (i - expected) / np.sqrt(variance)
+    return i, z_score, 2 * norm.sf(abs(z_score))
+
+
+def getis_ord(weights, x):
+    '''Local Getis-Ord Gi* z score of every tract: how far the sum of x over the tract and its
+    neighbours is from what the mean would give, in standard deviations. NaN where x is'''
+    weights, values, valid = _valid(weights, x)
+    n = len(values)
+    star = weights + sparse.identity(n, format='csr')
+    w_sum = np.asarray(star.sum(axis=1)).ravel()
+    w_squares = np.asarray(star.power(2).sum(axis=1)).ravel()
+    mean = values.mean()
+    spread = np.sqrt((values ** 2).mean() - mean ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (star @ values - mean * w_sum) / (spread * np.sqrt((n * w_squares - w_sum ** 2) / (n - 1)))
+    result = np.full(len(valid), np.nan)
+    result[valid] = z
+    return result
+
+
+def hot_spot_classes(z):
+    '''Bins Gi* z scores into hot and cold spots at 90, 95 and 99% confidence'''
+    conditions = [z >= cut for cut, _ in HOT_SPOT_BINS] + [z <= cut for cut, _ in COLD_SPOT_BINS] + [np.isnan(z)]
+    names = [name for _, name in HOT_SPOT_BINS + COLD_SPOT_BINS] + [NO_DATA]
+    return np.select(conditions, names, default=NOT_SIGNIFICANT)
+
+
+def cluster_statistics(weights, frame, columns=CLUSTER_COLUMNS):
+    '''Returns the hot spot class of every tract for each column (as <column>_hot_spot) and
+    a table of every column's global Moran's I'''
+    classes, summary = {}, []
+    for column in columns:
+        x = frame[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        classes[column + '_hot_spot'] = hot_spot_classes(getis_ord(weights, x))
+        i, z_score, p_value = morans_i(weights, x)
+        summary.append({'column': column, 'morans_i': i, 'z_score': z_score, 'p_value': p_value})
+    return pd.DataFrame(classes, index=frame.index), pd.DataFrame(summary)
+
+
+def load_tract_graph(statefps, kind='queen'):
+    '''Returns (GEOIDs, adjacency matrix) of the stored tracts of the given states, cached
+    on disk until the tract store changes'''
+    name = 'tract_graph_%s_' % kind + '_'.join('%02d' % s for s in sorted(statefps))
+    def build():
+        tracts = load_state_tracts(statefps)
+        return tracts['GEOID'].to_numpy(dtype=np.int64), contiguity_graph(tracts.geometry.values, kind)
+    return cached_frame(name, store_files(statefps), build)
+
+
+if __name__ == '__main__':
+    #usage: python tract_graph.py [queen|rook] [atlas.csv] -- Moran's I over every stored state,
+    #with the national food_atlas2019.csv by default
+    kind = sys.argv[1] if len(sys.argv) > 1 else 'queen'
+    atlas_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(ROOT_DIR, 'food_atlas2019.csv')
+    start = time.perf_counter()
+    geoids, weights = load_tract_graph(available_states() or [26], kind)
+    print('%d tracts, %d %s links (%.1fs)' % (len(geoids), weights.nnz // 2, kind, time.perf_counter() - start))
+    atlas = read_atlas(atlas_path, FOOD_ATLAS_COLUMNS)
+    atlas['food_desert_label'] = food_desert_labels(atlas)
+    frame = pd.DataFrame({'CensusTract': geoids}).merge(atlas, on='CensusTract', how='left')
+    start = time.perf_counter()
+    classes, summary = cluster_statistics(weights, frame)
+    print(summary.to_string(index=False))
+    for column in classes:
+        print(classes[column].value_counts().reindex(HOT_SPOT_CLASSES, fill_value=0).rename(column).to_string())
+    print('statistics: %.2fs' % (time.perf_counter() - start))
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+#a tract GEOID SSCCCTTTTTT as int64 nests its levels as decimal ranges: every tract of state SS
+#lies in [SS * 10**9, (SS + 1) * 10**9), every tract of county SSCCC in [SSCCC * 10**6, (SSCCC + 1) * 10**6)
+COUNTY_DIGITS = 10 ** 6
+STATE_DIGITS = 10 ** 9
+GEOID_LENGTH = 11
+
+
+def encode_keys(state, county, tract):
+    '''Builds int64 tract keys from state, county and tract codes'''
+    return (np.asarray(state, dtype=np.int64) * STATE_DIGITS + np.asarray(county, dtype=np.int64) * COUNTY_DIGITS
+            + np.asarray(tract, dtype=np.int64))
+
+
+def decode_keys(keys):
+    '''Splits int64 tract keys into (state, county, tract) code arrays'''
+    keys = np.asarray(keys, dtype=np.int64)
+    return keys // STATE_DIGITS, keys // COUNTY_DIGITS % 1000, keys % COUNTY_DIGITS
+
+
+def parse_geoids(values):
+    '''Converts 11 character GEOID strings to int64 keys, rejecting any other length so a
+    county or block group code can never pass for a tract'''
+    text = np.asarray(values, dtype=str)
+    if len(text) and (np.char.str_len(text) != GEOID_LENGTH).any():
+        raise ValueError('tract GEOIDs must have %d digits' % GEOID_LENGTH)
+    return text.astype(np.int64)
+
+
+def prefix_range(prefix):
+    '''Returns the [low, high) key range of a state (SS), county (SSCCC) or tract code'''
+    prefix = int(prefix)
+    if prefix < 100:
+        return prefix * STATE_DIGITS, (prefix + 1) * STATE_DIGITS
+    if prefix < 100000:
+        return prefix * COUNTY_DIGITS, (prefix + 1) * COUNTY_DIGITS
+    return prefix, prefix + 1
+
+
+class KeyIndex(object):
+    '''Sorted int64 tract keys of a table and the row each one came from. A state or county
+    is then a binary search for the two ends of its key range; a table already in key order
+    (the tract store, the merged Michigan frame) needs no row order at all'''
+
+    def __init__(self, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(keys) and (np.diff(keys) < 0).any():
+            self.order = np.argsort(keys, kind='stable')
+            self.keys = keys[self.order]
+        else:
+            self.order = None
+            self.keys = keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def span(self, prefix):
+        '''Returns the (start, stop) positions of a state, county or tract in the sorted keys'''
+        low, high = prefix_range(prefix)
+        return int(np.searchsorted(self.keys, low)), int(np.searchsorted(self.keys, high))
+
+    def rows(self, positions):
+        '''Maps positions in the sorted keys back to rows of the table'''
+        return positions if self.order is None else self.order[positions]
+
+    def take(self, frame, prefix):
+        '''Returns the rows of frame in a state, county or tract, in key order'''
+        start, stop = self.span(prefix)
+        if self.order is None:
+            return frame.iloc[start:stop]
+        return frame.iloc[self.order[start:stop]]
+
+    def positions(self, keys):
+        '''Returns the position of every key in the sorted keys, -1 where it is missing'''
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.intp)
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[found] == keys, found, -1)
+
+
+def merge_join(left, right, left_on, right_on, left_index=None, right_index=None):
+    '''Inner join of two tables on int64 tract keys, the result in key order. Each left key is
+    found among the sorted right keys by binary search, so no hash table is built, and indexes
+    built once can be passed in and reused. Right keys must be unique'''
+    left_index = KeyIndex(left[left_on]) if left_index is None else left_index
+    right_index = KeyIndex(right[right_on]) if right_index is None else right_index
+    if (np.diff(right_index.keys) == 0).any():
+        raise ValueError('%s has duplicate keys' % right_on)
+    overlap = set(left.columns) & set(right.columns)
+    if overlap:
+        raise ValueError('both tables have columns %s' % sorted(overlap))
+
+    matches = right_index.positions(left_index.keys)
+    found = matches >= 0
+    left_rows = left_index.rows(np.flatnonzero(found))
+    right_rows = right_index.rows(matches[found])
+    #both sides come out on the same fresh range index, so concat lines them up without the alignment join does
+    return pd.concat([left.iloc[left_rows].reset_index(drop=True), right.iloc[right_rows].reset_index(drop=True)], axis=1)
+
+
+if __name__ == '__main__':
+    #usage: python tract_keys.py [atlas.csv] -- times the stored Michigan tracts joined with the atlas,
+    #the current pandas merge against merge_join, and a county selected by mask against a range slice
+    from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+    from tract_store import load_state_tracts
+
+    atlas_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'MI_food_atlas2019.csv')
+    tracts = load_state_tracts([26])
+    atlas = read_atlas(atlas_path, FOOD_ATLAS_COLUMNS)
+
+    def best(function, repeat=20):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        return result, min(times) * 1000
+
+    merged, merge_ms = best(lambda: tracts.merge(atlas, left_on='GEOID', right_on='CensusTract', how='inner').sort_values('CensusTract').reset_index(drop=True))
+    indexes, index_ms = best(lambda: (KeyIndex(tracts['GEOID']), KeyIndex(atlas['CensusTract'])))
+    joined, join_ms = best(lambda: merge_join(tracts, atlas, 'GEOID', 'CensusTract', *indexes))
+    assert joined.equals(merged[joined.columns]), 'merge_join and merge disagree'
+    print('%d tracts x %d atlas rows -> %d' % (len(tracts), len(atlas), len(joined)))
+    print('pandas merge + sort: %7.2f ms' % merge_ms)
+    print('merge_join:          %7.2f ms (+ %.2f ms to build both indexes once)' % (join_ms, index_ms))
+
+    county = int(merged['CensusTract'].iloc[len(merged) // 2] // COUNTY_DIGITS)
+    _, mask_ms = best(lambda: merged[merged['CensusTract'] // COUNTY_DIGITS == county])
+    merged_index = KeyIndex(merged['CensusTract'])
+    _, slice_ms = best(lambda: merged_index.take(merged, county))
+    print('county %05d by mask: %7.3f ms, by range slice: %7.3f ms' % (county, mask_ms, slice_ms))
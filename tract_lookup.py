@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from atlas_schema import FOOD_ATLAS_COLUMNS, read_atlas
+from data_cache import cached_frame
+from lila_rules import food_desert_labels
+from tract_store import available_states, load_state_tracts, store_files
+
+ROOT_DIR = os.path.dirname(__file__)
+
+#columns a lookup returns for every point
+LOOKUP_COLUMNS = ['CensusTract', 'food_desert_label', 'TractSNAP', 'PovertyRate']
+
+
+class TractIndex(object):
+    '''STRtree over tract polygons for batch point-in-tract lookups. The tree only narrows
+    each point down to the tracts whose bounding box holds it; the exact test then runs
+    on prepared polygons for all candidate pairs at once'''
+
+    def __init__(self, frame, columns=LOOKUP_COLUMNS):
+        self.columns = list(columns)
+        self.geometry = np.asarray(frame.geometry.values)
+        self.attributes = {column: frame[column].to_numpy() for column in self.columns}
+        self._build()
+
+    def _build(self):
+        shapely.prepare(self.geometry)
+        self.tree = shapely.STRtree(self.geometry)
+
+    #pickled as WKB and the attribute arrays; the tree is rebuilt on load
+    def __getstate__(self):
+        return {'columns': self.columns, 'wkb': shapely.to_wkb(self.geometry), 'attributes': self.attributes}
+
+    def __setstate__(self, state):
+        self.columns = state['columns']
+        self.attributes = state['attributes']
+        self.geometry = shapely.from_wkb(state['wkb'])
+        self._build()
+
+    def tract_rows(self, lon, lat):
+        '''Returns, for every lon/lat pair, the row of the tract holding it or -1.
+        A point on a tract's boundary counts as inside it, and a point on a shared border goes
+        to the first of its tracts'''
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        points, candidates = self.tree.query(shapely.points(lon, lat))
+        #contains_xy is false on the boundary, which would leave border points in no tract
+        inside = shapely.intersects_xy(self.geometry[candidates], lon[points], lat[points])
+        points, candidates = points[inside], candidates[inside]
+        #the tree gives each point's candidates in no set order, the first tract is the lowest row
+        order = np.lexsort((candidates, points))
+        points, candidates = points[order], candidates[order]
+        rows = np.full(len(lon), -1, dtype=np.int64)
+        rows[points[::-1]] = candidates[::-1]
+        return rows
+
+    def lookup(self, lon, lat):
+        '''Returns CensusTract, food_desert_label, TractSNAP and PovertyRate for every lon/lat
+        pair, in input order; points outside every tract get missing values'''
+        rows = self.tract_rows(lon, lat)
+        found = rows >= 0
+        result = {}
+        for column in self.columns:
+            values = self.attributes[column][np.maximum(rows, 0)]
+            if np.issubdtype(values.dtype, np.integer):
+                values = pd.array(values, dtype='Int64')
+                values[~found] = pd.NA
+            else:
+                values = np.where(found, values, np.nan)
+            result[column] = values
+        return pd.DataFrame(result)
+
+
+def merged_tracts(statefps, atlas_path):
+    '''Merges the stored tracts of the given states with a food atlas and its labels'''
+    tracts = load_state_tracts(statefps)
+    atlas = read_atlas(atlas_path, FOOD_ATLAS_COLUMNS)
+    atlas['food_desert_label'] = food_desert_labels(atlas)
+    return tracts.merge(atlas, left_on='GEOID', right_on='CensusTract', how='inner')[['geometry'] + LOOKUP_COLUMNS]
+
+
+def load_tract_index(statefps, atlas_path):
+    '''Returns the index of the given states, cached on disk until the tracts or atlas change'''
+    name = 'tract_index_' + '_'.join('%02d' % s for s in sorted(statefps))
+    return cached_frame(name, store_files(statefps) + [atlas_path], lambda: TractIndex(merged_tracts(statefps, atlas_path)))
+
+
+def benchmark(index, count=100000, seed=0):
+    '''Looks up count random points inside the index's bounds, returns points per second'''
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = shapely.total_bounds(index.geometry)
+    lon, lat = rng.uniform(minx, maxx, count), rng.uniform(miny, maxy, count)
+    start = time.perf_counter()
+    index.lookup(lon, lat)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    #usage: python tract_lookup.py points.csv [out.csv] [atlas.csv] -- points.csv needs lon and lat columns
+    #       python tract_lookup.py bench [atlas.csv]
+    #every stored state is indexed, with MI_food_atlas2019.csv as the default atlas
+    if len(sys.argv) < 2:
+        sys.exit('usage: python tract_lookup.py points.csv [out.csv] [atlas.csv] | bench [atlas.csv]')
+    bench = sys.argv[1] == 'bench'
+    atlas_args = sys.argv[2:3] if bench else sys.argv[3:4]
+    atlas_path = atlas_args[0] if atlas_args else os.path.join(ROOT_DIR, 'MI_food_atlas2019.csv')
+    index = load_tract_index(available_states() or [26], atlas_path)
+    if bench:
+        print('%d tracts: %.0f points/s' % (len(index.geometry), benchmark(index)))
+    else:
+        points = pd.read_csv(sys.argv[1])
+        result = pd.concat([points, index.lookup(points['lon'], points['lat'])], axis=1)
+        if len(sys.argv) > 2:
+            result.to_csv(sys.argv[2], index=False)
+        else:
+            print(result.to_string())
@@ -0,0 +1,96 @@
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+
+from tract_keys import parse_geoids
+
+ROOT_DIR = os.path.dirname(__file__)
+CENSUS_TRACT_PATH = os.path.join(ROOT_DIR, "cb_2019_us_tract_500k.shx")
+TRACT_STORE_DIR = os.path.join(ROOT_DIR, "tract_store")
+
+#partitions read at once when several states are loaded
+READ_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def partition_path(statefp, store_dir=TRACT_STORE_DIR):
+    '''Returns the GeoParquet file holding the tracts of one state'''
+    return os.path.join(store_dir, "STATEFP=%02d" % int(statefp), "tracts.parquet")
+
+
+def store_exists(store_dir=TRACT_STORE_DIR):
+    '''Checks whether the ingest step has been run'''
+    return os.path.isdir(store_dir) and any(name.startswith("STATEFP=") for name in os.listdir(store_dir))
+
+
+def available_states(store_dir=TRACT_STORE_DIR):
+    '''Lists the STATEFP codes that have a partition in the store'''
+    if not store_exists(store_dir):
+        return []
+    return sorted(int(name.split("=")[1]) for name in os.listdir(store_dir) if name.startswith("STATEFP="))
+
+
+def ingest(shapefile_path=CENSUS_TRACT_PATH, store_dir=TRACT_STORE_DIR):
+    '''Reads the national tract shapefile once and writes one GeoParquet file per state,
+    with STATEFP and GEOID stored as integers'''
+    tracts = gpd.read_file(shapefile_path)
+    tracts['STATEFP'] = pd.to_numeric(tracts['STATEFP']).astype('int64')
+    tracts['GEOID'] = parse_geoids(tracts['GEOID'])
+    tracts = tracts.sort_values('GEOID')
+
+    #write into a temporary folder and swap it in, so readers never see half a store
+    tmp_dir = store_dir + ".tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    for statefp, state_tracts in tracts.groupby('STATEFP'):
+        path = partition_path(statefp, tmp_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        state_tracts.reset_index(drop=True).to_parquet(path, index=False)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    return tracts['STATEFP'].nunique()
+
+
+def load_state_tracts(statefps, store_dir=TRACT_STORE_DIR, shapefile_path=CENSUS_TRACT_PATH):
+    '''Returns the tracts of the given states. Only their partitions are read when the
+    store exists, otherwise the national shapefile is read and filtered'''
+    statefps = [int(s) for s in statefps]
+    if not store_exists(store_dir):
+        tracts = gpd.read_file(shapefile_path)
+        tracts['STATEFP'] = pd.to_numeric(tracts['STATEFP'])
+        tracts['GEOID'] = parse_geoids(tracts['GEOID'])
+        #in GEOID order like the store partitions, so key joins and county ranges hold either way
+        return tracts[tracts['STATEFP'].isin(statefps)].sort_values('GEOID').reset_index(drop=True)
+
+    paths = [partition_path(s, store_dir) for s in statefps if os.path.exists(partition_path(s, store_dir))]
+    if len(paths) > 1:
+        #parquet decoding releases the GIL, so partitions are read side by side
+        with ThreadPoolExecutor(max_workers=min(len(paths), READ_WORKERS)) as pool:
+            frames = list(pool.map(gpd.read_parquet, paths))
+    else:
+        frames = [gpd.read_parquet(path) for path in paths]
+    if not frames:
+        raise ValueError("no tracts stored for STATEFP %s" % statefps)
+    if len(frames) == 1:
+        return frames[0]
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+
+
+def store_files(statefps, store_dir=TRACT_STORE_DIR, shapefile_path=CENSUS_TRACT_PATH):
+    '''Returns the files load_state_tracts reads, for use as cache inputs'''
+    if store_exists(store_dir):
+        return [partition_path(s, store_dir) for s in statefps]
+    return [os.path.splitext(shapefile_path)[0] + ext for ext in [".shp", ".shx", ".dbf", ".prj"]]
+
+
+if __name__ == "__main__":
+    #usage: python tract_store.py [path to national tract shapefile]
+    path = sys.argv[1] if len(sys.argv) > 1 else CENSUS_TRACT_PATH
+    start = time.perf_counter()
+    count = ingest(path)
+    print("wrote %d state partitions to %s in %.1fs" % (count, TRACT_STORE_DIR, time.perf_counter() - start))